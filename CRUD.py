@@ -1,4 +1,5 @@
 import sqlite3
+import hashlib
 import pathlib
 import sys
 import traceback
@@ -33,15 +34,167 @@ def initialize_database(db: sqlite3.Connection) -> None:
 
     CREATE TABLE IF NOT EXISTS user2card (
         user_id INTEGER NOT NULL,
-        card_uuid TEXT(36),
+        card_id INTEGER NOT NULL,
         trade INTEGER NOT NULL DEFAULT 0,
         amount INTEGER NOT NULL DEFAULT 0,
         FOREIGN KEY (user_id)
             REFERENCES user (id),
-        FOREIGN KEY (card_uuid)
-            REFERENCES cards (uuid),
-        UNIQUE (user_id, card_uuid)
+        FOREIGN KEY (card_id)
+            REFERENCES cards (id),
+        UNIQUE (user_id, card_id)
     );
+
+    CREATE TABLE IF NOT EXISTS unmatched_cards (
+        user_id INTEGER NOT NULL,
+        card_uuid TEXT NOT NULL,
+        trade INTEGER NOT NULL DEFAULT 0,
+        amount INTEGER NOT NULL DEFAULT 0
+    );
+
+    CREATE INDEX IF NOT EXISTS user2card_trade
+        ON user2card (card_id, user_id) WHERE trade = 1;
+
+    CREATE TABLE IF NOT EXISTS price_history (
+        scryfallId TEXT NOT NULL,
+        date TEXT NOT NULL,
+        usd INTEGER,
+        usd_foil INTEGER,
+        PRIMARY KEY (scryfallId, date)
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS node (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        name TEXT NOT NULL,
+        replaying INTEGER NOT NULL DEFAULT 0
+    );
+    INSERT OR IGNORE INTO node (id, name)
+    VALUES (1, lower(hex(randomblob(8))));
+
+    CREATE TABLE IF NOT EXISTS change_log (
+        node TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        user_name TEXT NOT NULL,
+        card_uuid TEXT NOT NULL,
+        delta INTEGER NOT NULL,
+        trade INTEGER,
+        PRIMARY KEY (node, seq)
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS held_changes (
+        node TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        user_name TEXT NOT NULL,
+        card_uuid TEXT NOT NULL,
+        delta INTEGER NOT NULL,
+        trade INTEGER,
+        PRIMARY KEY (node, seq)
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS peer_clock (
+        peer TEXT NOT NULL,
+        node TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        PRIMARY KEY (peer, node)
+    ) WITHOUT ROWID;
+
+    CREATE TRIGGER IF NOT EXISTS user2card_log_insert
+    AFTER INSERT ON user2card
+    WHEN (SELECT replaying FROM node) = 0 AND NEW.amount != 0
+    BEGIN
+        INSERT INTO change_log
+        SELECT n.name,
+        COALESCE((SELECT MAX(seq) FROM change_log WHERE node = n.name), 0) + 1,
+        (SELECT name FROM user WHERE id = NEW.user_id),
+        (SELECT uuid FROM cards WHERE id = NEW.card_id),
+        NEW.amount, NULLIF(NEW.trade, 0)
+        FROM node n;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS user2card_log_update
+    AFTER UPDATE OF amount, trade ON user2card
+    WHEN (SELECT replaying FROM node) = 0
+        AND (OLD.amount != NEW.amount OR OLD.trade != NEW.trade)
+    BEGIN
+        INSERT INTO change_log
+        SELECT n.name,
+        COALESCE((SELECT MAX(seq) FROM change_log WHERE node = n.name), 0) + 1,
+        (SELECT name FROM user WHERE id = NEW.user_id),
+        (SELECT uuid FROM cards WHERE id = NEW.card_id),
+        NEW.amount - OLD.amount,
+        CASE WHEN OLD.trade != NEW.trade THEN NEW.trade END
+        FROM node n;
+    END;
+    CREATE TABLE IF NOT EXISTS user_summary (
+        user_id INTEGER NOT NULL,
+        setCode TEXT NOT NULL,
+        colors TEXT NOT NULL,
+        rarity TEXT NOT NULL,
+        copies INTEGER NOT NULL,
+        uniques INTEGER NOT NULL,
+        value INTEGER NOT NULL,
+        PRIMARY KEY (user_id, setCode, colors, rarity)
+    ) WITHOUT ROWID;
+
+    CREATE TRIGGER IF NOT EXISTS user2card_summary_insert
+    AFTER INSERT ON user2card
+    WHEN NEW.amount > 0
+    BEGIN
+        INSERT INTO user_summary
+        SELECT NEW.user_id, COALESCE(c.setCode, ''),
+        COALESCE(c.colors, ''), COALESCE(c.rarity, ''),
+        NEW.amount, 1, NEW.amount * COALESCE((
+            SELECT COALESCE(p.usd, p.usd_foil) FROM price_history p
+            WHERE p.scryfallId = c.scryfallId
+            ORDER BY p.date DESC LIMIT 1
+        ), 0)
+        FROM cards c WHERE c.id = NEW.card_id
+        ON CONFLICT (user_id, setCode, colors, rarity) DO UPDATE
+        SET copies = copies + excluded.copies,
+        uniques = uniques + excluded.uniques,
+        value = value + excluded.value;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS user2card_summary_update
+    AFTER UPDATE OF amount ON user2card
+    WHEN MAX(OLD.amount, 0) != MAX(NEW.amount, 0)
+    BEGIN
+        INSERT INTO user_summary
+        SELECT NEW.user_id, COALESCE(c.setCode, ''),
+        COALESCE(c.colors, ''), COALESCE(c.rarity, ''),
+        MAX(NEW.amount, 0) - MAX(OLD.amount, 0),
+        (NEW.amount > 0) - (OLD.amount > 0),
+        (MAX(NEW.amount, 0) - MAX(OLD.amount, 0)) * COALESCE((
+            SELECT COALESCE(p.usd, p.usd_foil) FROM price_history p
+            WHERE p.scryfallId = c.scryfallId
+            ORDER BY p.date DESC LIMIT 1
+        ), 0)
+        FROM cards c WHERE c.id = NEW.card_id
+        ON CONFLICT (user_id, setCode, colors, rarity) DO UPDATE
+        SET copies = copies + excluded.copies,
+        uniques = uniques + excluded.uniques,
+        value = value + excluded.value;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS user2card_summary_delete
+    AFTER DELETE ON user2card
+    WHEN OLD.amount > 0
+    BEGIN
+        UPDATE user_summary
+        SET copies = copies - OLD.amount, uniques = uniques - 1,
+        value = value - OLD.amount * (
+            SELECT COALESCE((
+                SELECT COALESCE(p.usd, p.usd_foil) FROM price_history p
+                WHERE p.scryfallId = c.scryfallId
+                ORDER BY p.date DESC LIMIT 1
+            ), 0)
+            FROM cards c WHERE c.id = OLD.card_id
+        )
+        WHERE (user_id, setCode, colors, rarity) = (
+            SELECT OLD.user_id, COALESCE(c.setCode, ''),
+            COALESCE(c.colors, ''), COALESCE(c.rarity, '')
+            FROM cards c WHERE c.id = OLD.card_id
+        );
+    END;
     """
 
     try:
@@ -51,6 +204,199 @@ def initialize_database(db: sqlite3.Connection) -> None:
         print(e, file=sys.stderr)
 
 
+def initialize_sync(db: sqlite3.Connection) -> None:
+    """
+        Log the whole collection once as changes, so the first sync of an
+        existing database carries what is already there.
+        The baseline is logged under a node named after its contents.
+        Copies of one database get the same baseline, which then counts
+        as already seen when they sync instead of doubling every card.
+    """
+    query = """
+    SELECT u.name, c.uuid, x.amount, NULLIF(x.trade, 0)
+    FROM user2card x
+    JOIN user u ON u.id = x.user_id
+    JOIN cards c ON c.id = x.card_id
+    WHERE x.amount != 0 AND NOT EXISTS (SELECT 1 FROM change_log)
+    ORDER BY u.name, c.uuid
+    """
+    try:
+        rows = db.execute(query).fetchall()
+    except sqlite3.OperationalError:
+        # No catalog yet
+        return
+    if not rows:
+        return
+    digest = hashlib.sha1(repr(rows).encode()).hexdigest()[:16]
+    with db:
+        db.executemany(
+            "INSERT INTO change_log VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                (f'base-{digest}', seq, *row)
+                for seq, row in enumerate(rows, start=1)
+            )
+        )
+
+
+def rebuild_summary(db: sqlite3.Connection) -> None:
+    """
+        Recount user_summary from user2card and revalue it at the latest
+        prices. The triggers on user2card keep it current after that.
+    """
+    query = """
+    INSERT INTO user_summary
+    SELECT x.user_id, COALESCE(c.setCode, ''),
+    COALESCE(c.colors, ''), COALESCE(c.rarity, ''),
+    SUM(x.amount), COUNT(*),
+    SUM(x.amount * COALESCE(p.usd, p.usd_foil, 0))
+    FROM user2card x
+    JOIN cards c ON c.id = x.card_id
+    LEFT JOIN price_history p ON p.scryfallId = c.scryfallId
+    AND p.date = (
+        SELECT MAX(date) FROM price_history WHERE scryfallId = c.scryfallId
+    )
+    WHERE x.amount > 0
+    GROUP BY 1, 2, 3, 4
+    """
+    try:
+        with db:
+            db.execute("DELETE FROM user_summary")
+            db.execute(query)
+    except Exception as e:
+        print(e, file=sys.stderr)
+        traceback.print_exc()
+
+
+def revalue_summary(db: sqlite3.Connection, scry_ids: List[str]) -> None:
+    """
+        Recompute the value of every user_summary group holding one of the
+        cards just priced, so the triggers keep adding and subtracting at
+        the same price the group was valued at.
+    """
+    query = """
+    UPDATE user_summary SET value = COALESCE((
+        SELECT SUM(x.amount * COALESCE((
+            SELECT COALESCE(p.usd, p.usd_foil) FROM price_history p
+            WHERE p.scryfallId = c.scryfallId
+            ORDER BY p.date DESC LIMIT 1
+        ), 0))
+        FROM user2card x
+        JOIN cards c ON c.id = x.card_id
+        WHERE x.user_id = user_summary.user_id AND x.amount > 0
+        AND COALESCE(c.setCode, '') = user_summary.setCode
+        AND COALESCE(c.colors, '') = user_summary.colors
+        AND COALESCE(c.rarity, '') = user_summary.rarity
+    ), 0)
+    WHERE (user_id, setCode, colors, rarity) IN (
+        SELECT x.user_id, COALESCE(c.setCode, ''),
+        COALESCE(c.colors, ''), COALESCE(c.rarity, '')
+        FROM temp.priced t
+        JOIN cards c ON c.scryfallId = t.scryfallId
+        JOIN user2card x ON x.card_id = c.id
+    )
+    """
+    try:
+        with db:
+            db.execute("CREATE TEMP TABLE priced (scryfallId TEXT PRIMARY KEY)")
+            db.executemany(
+                "INSERT OR IGNORE INTO temp.priced VALUES (?)",
+                ((scry_id,) for scry_id in scry_ids)
+            )
+            db.execute(query)
+            db.execute("DROP TABLE temp.priced")
+    except Exception as e:
+        print(e, file=sys.stderr)
+        traceback.print_exc()
+
+
+def initialize_summary(db: sqlite3.Connection) -> None:
+    """
+        Fill user_summary for databases made before it existed.
+    """
+    if not get_columns(db, 'cards'):
+        return
+    if db.execute("SELECT 1 FROM user_summary LIMIT 1").fetchone():
+        return
+    if db.execute("SELECT 1 FROM user2card WHERE amount > 0 LIMIT 1").fetchone():
+        rebuild_summary(db)
+
+
+def initialize_catalog(db: sqlite3.Connection) -> None:
+    """
+        Index the card catalog columns the app looks cards up by.
+        Does nothing until a catalog has been downloaded.
+    """
+    script = """
+    CREATE INDEX IF NOT EXISTS cards_name ON cards (name);
+    CREATE INDEX IF NOT EXISTS cards_tcgplayer ON cards (tcgplayerProductID);
+    CREATE INDEX IF NOT EXISTS cards_scryfall ON cards (scryfallId);
+    CREATE UNIQUE INDEX IF NOT EXISTS cards_uuid ON cards (uuid);
+    """
+    try:
+        with db:
+            db.executescript(script)
+    except sqlite3.OperationalError:
+        pass
+
+
+def build_catalog(db: sqlite3.Connection, source: Path) -> None:
+    """
+        Copy only the card columns the app uses out of an AllPrintings
+        database into db. Identifiers missing from the cards table are
+        taken from cardIdentifiers, as newer MTGJSON files keep them there.
+    """
+    columns = {
+        'uuid': 'TEXT NOT NULL',
+        'name': 'TEXT NOT NULL',
+        'rarity': 'TEXT',
+        'type': 'TEXT',
+        'setCode': 'TEXT',
+        'colors': 'TEXT',
+        'manaCost': 'TEXT',
+        'text': 'TEXT',
+        'scryfallId': 'TEXT',
+        'tcgplayerProductID': 'TEXT',
+        'borderColor': 'TEXT',
+        'frameEffects': 'TEXT',
+        'manaValue': 'REAL',
+    }
+    # Older AllPrintings files call manaValue convertedManaCost
+    aliases = {'manavalue': 'convertedManaCost'}
+    db.execute("ATTACH DATABASE ? AS src", (str(source),))
+    try:
+        card_columns = {
+            row[1].lower()
+            for row in db.execute("PRAGMA src.table_info(cards)")
+        }
+        select = []
+        for name in columns:
+            alias = aliases.get(name.lower(), '')
+            if name.lower() in card_columns:
+                select.append(f'c.{name}')
+            elif alias.lower() in card_columns:
+                select.append(f'c.{alias}')
+            else:
+                select.append(f'i.{name}')
+        join = ''
+        if any(column.startswith('i.') for column in select):
+            join = 'LEFT JOIN src.cardIdentifiers i ON i.uuid = c.uuid'
+        definition = ',\n'.join(
+            ['id INTEGER PRIMARY KEY']
+            + [f'{k} {v}' for k, v in columns.items()]
+        )
+        with db:
+            db.execute("DROP TABLE IF EXISTS main.cards")
+            db.execute(f"CREATE TABLE main.cards ({definition})")
+            db.execute(f"""
+            INSERT INTO main.cards ({', '.join(columns)})
+            SELECT {', '.join(select)}
+            FROM src.cards c {join}
+            """)
+    finally:
+        db.execute("DETACH DATABASE src")
+    initialize_catalog(db)
+
+
 # Create Functions
 def add_user(db: sqlite3.Connection, user: User) -> Tuple:
     """
@@ -72,8 +418,14 @@ def add_user(db: sqlite3.Connection, user: User) -> Tuple:
 
 
 def gen_cards(user: User, cards: List[Card]) -> Generator:
+    """
+        One row per uuid with the amounts of repeated cards added up.
+    """
+    amounts = {}
     for card in cards:
-        yield (user.id, card._uuid, card.amount)
+        amounts[card._uuid] = amounts.get(card._uuid, 0) + card.amount
+    for uuid, amount in amounts.items():
+        yield (user.id, uuid, amount)
 
 
 def add_cards(db: sqlite3.Connection, user: User, cards: List[Card]) -> int:
@@ -81,8 +433,10 @@ def add_cards(db: sqlite3.Connection, user: User, cards: List[Card]) -> int:
         Add cards to user's collection and return the amount added this way.
     """
     query = """
-    INSERT INTO user2card (user_id, card_uuid, amount)
-    VALUES (?, ?, ?)
+    INSERT INTO user2card (user_id, card_id, amount)
+    SELECT ?1, id, ?3 FROM cards WHERE uuid = ?2
+    ON CONFLICT (user_id, card_id)
+    DO UPDATE SET amount = amount + excluded.amount
     """
     rowcount = 0
     try:
@@ -97,6 +451,13 @@ def add_cards(db: sqlite3.Connection, user: User, cards: List[Card]) -> int:
 
 
 # Read Functions
+def needs_migration(db: sqlite3.Connection) -> bool:
+    """
+        Older databases keep the card uuid text in user2card.
+    """
+    return 'card_uuid' in get_columns(db, 'user2card')
+
+
 def get_user_id(db: sqlite3.Connection, user: User) -> int:
     """
         Query database for logged in user's id.
@@ -138,9 +499,9 @@ def get_cards(
     """
     query_sql = """
     SELECT c.name, c.rarity, c.type, c.setCode, c.colors,
-    x.amount, x.card_uuid, c.scryfallId
+    x.amount, c.uuid, c.scryfallId
     FROM user2card x
-    JOIN cards c ON c.uuid = x.card_uuid
+    JOIN cards c ON c.id = x.card_id
     WHERE x.user_id = {} AND
     c.name LIKE \'{}\' AND
     x.amount > 0;
@@ -171,9 +532,9 @@ def get_cards_user(
     """
     query_sql = """
     SELECT c.name, c.rarity, c.type, c.setCode, c.colors,
-    x.amount, x.card_uuid, c.scryfallId
+    x.amount, c.uuid, c.scryfallId
     FROM user2card x
-    JOIN cards c ON c.uuid = x.card_uuid
+    JOIN cards c ON c.id = x.card_id
     WHERE x.user_id = {}
     LIMIT {};
     """
@@ -190,6 +551,399 @@ def get_cards_user(
     return curr.fetchall()
 
 
+def iter_cards_user(
+    db: sqlite3.Connection,
+    user: User,
+    limit: int = -1,
+    size: int = 500,
+) -> Generator:
+    """
+        Query database for user's cards, yielding lists of size rows.
+        A negative limit returns the whole collection.
+    """
+    query = """
+    SELECT c.name, c.rarity, c.type, c.setCode, c.colors,
+    x.amount, c.uuid, c.scryfallId
+    FROM user2card x
+    JOIN cards c ON c.id = x.card_id
+    WHERE x.user_id = ?
+    LIMIT ?
+    """
+    try:
+        curr = db.execute(query, (user.id, limit))
+        while rows := curr.fetchmany(size):
+            yield rows
+    except Exception as e:
+        print(e, file=sys.stderr)
+        traceback.print_exc()
+
+
+def get_cards_user_prices(
+    db: sqlite3.Connection,
+    user: User,
+    limit: int = 10,
+) -> List:
+    """
+        Query database for user's cards with their latest local prices.
+    """
+    query = """
+    SELECT c.name, c.rarity, c.type, c.setCode, c.colors,
+    x.amount, c.uuid, c.scryfallId, p.usd, p.usd_foil
+    FROM user2card x
+    JOIN cards c ON c.id = x.card_id
+    LEFT JOIN price_history p ON p.scryfallId = c.scryfallId
+        AND p.date = (
+            SELECT MAX(date) FROM price_history
+            WHERE scryfallId = c.scryfallId
+        )
+    WHERE x.user_id = ?
+    LIMIT ?
+    """
+    try:
+        with db:
+            curr = db.execute(query, (user.id, limit))
+    except Exception as e:
+        print(e, file=sys.stderr)
+        traceback.print_exc()
+        return []
+
+    return curr.fetchall()
+
+
+def get_collection_columns(db: sqlite3.Connection, user: User) -> List:
+    """
+        One row per card of user's collection for analytics:
+        amount, latest price in cents, rarity, color mask (W=1 U=2 B=4
+        R=8 G=16), mana value, set code and whether it is a land.
+    """
+    mana_value = 'c.manaValue' if 'manaValue' in get_columns(db, 'cards') else '0'
+    query = f"""
+    SELECT x.amount,
+    COALESCE((
+        SELECT COALESCE(p.usd, p.usd_foil) FROM price_history p
+        WHERE p.scryfallId = c.scryfallId
+        ORDER BY p.date DESC LIMIT 1
+    ), 0),
+    COALESCE(c.rarity, ''),
+    COALESCE(
+        (instr(c.colors, 'W') > 0) + 2 * (instr(c.colors, 'U') > 0)
+        + 4 * (instr(c.colors, 'B') > 0) + 8 * (instr(c.colors, 'R') > 0)
+        + 16 * (instr(c.colors, 'G') > 0),
+    0),
+    COALESCE({mana_value}, 0),
+    COALESCE(c.setCode, ''),
+    COALESCE(instr(c.type, 'Land') > 0, 0)
+    FROM user2card x
+    JOIN cards c ON c.id = x.card_id
+    WHERE x.user_id = ? AND x.amount > 0
+    """
+    try:
+        with db:
+            curr = db.execute(query, (user.id,))
+    except Exception as e:
+        print(e, file=sys.stderr)
+        traceback.print_exc()
+        return []
+
+    return curr.fetchall()
+
+
+def get_summary(db: sqlite3.Connection, user: User, column: str) -> List:
+    """
+        Copies, unique printings and cached value in cents of user's
+        collection grouped by setCode, colors or rarity.
+    """
+    if column not in ('setCode', 'colors', 'rarity'):
+        raise ValueError(f'Cannot summarize by {column}.')
+    query = f"""
+    SELECT {column}, SUM(copies), SUM(uniques), SUM(value)
+    FROM user_summary
+    WHERE user_id = ?
+    GROUP BY {column}
+    HAVING SUM(copies) > 0
+    ORDER BY SUM(value) DESC, {column}
+    """
+    try:
+        with db:
+            curr = db.execute(query, (user.id,))
+    except Exception as e:
+        print(e, file=sys.stderr)
+        traceback.print_exc()
+        return []
+
+    return curr.fetchall()
+
+
+def get_owned_names(db: sqlite3.Connection, user: User) -> List[str]:
+    """
+        Distinct names of the cards user has.
+    """
+    query = """
+    SELECT DISTINCT c.name
+    FROM user2card x
+    JOIN cards c ON c.id = x.card_id
+    WHERE x.user_id = ? AND x.amount > 0
+    """
+    try:
+        with db:
+            curr = db.execute(query, (user.id,))
+    except Exception as e:
+        print(e, file=sys.stderr)
+        traceback.print_exc()
+        return []
+
+    return [row[0] for row in curr]
+
+
+def get_owned_sets(db: sqlite3.Connection, user: User) -> List[str]:
+    """
+        Distinct set codes of the cards user has.
+    """
+    query = """
+    SELECT DISTINCT c.setCode
+    FROM user2card x
+    JOIN cards c ON c.id = x.card_id
+    WHERE x.user_id = ? AND x.amount > 0 AND c.setCode IS NOT NULL
+    """
+    try:
+        with db:
+            curr = db.execute(query, (user.id,))
+    except Exception as e:
+        print(e, file=sys.stderr)
+        traceback.print_exc()
+        return []
+
+    return [row[0] for row in curr]
+
+
+def get_owned_ids(db: sqlite3.Connection) -> List:
+    """
+        Query database for (uuid, scryfallId) of every card any user has.
+    """
+    query = """
+    SELECT DISTINCT c.uuid, c.scryfallId
+    FROM user2card x
+    JOIN cards c ON c.id = x.card_id
+    """
+    try:
+        with db:
+            curr = db.execute(query)
+    except Exception as e:
+        print(e, file=sys.stderr)
+        traceback.print_exc()
+        return []
+
+    return curr.fetchall()
+
+
+def fill_deck_table(db: sqlite3.Connection, deck: List[Tuple[str, int]]) -> None:
+    """
+        Load a (name, amount) decklist into the connection's temp deck table.
+    """
+    script = """
+    CREATE TEMP TABLE IF NOT EXISTS deck (
+        name TEXT PRIMARY KEY,
+        wanted INTEGER NOT NULL
+    );
+    DELETE FROM temp.deck;
+    """
+    db.executescript(script)
+    db.executemany("INSERT INTO temp.deck VALUES (?, ?)", deck)
+
+
+def get_deck_diff(
+    db: sqlite3.Connection,
+    user: User,
+    deck: List[Tuple[str, int]],
+) -> List:
+    """
+        Compare a (name, amount) decklist against every printing the user
+        owns. Returns name, wanted, owned, known and the cheapest current
+        price in cents across printings for every card in the list.
+    """
+    query = """
+    SELECT d.name, d.wanted, COALESCE(o.owned, 0),
+    EXISTS (SELECT 1 FROM cards WHERE name = d.name),
+    pr.price
+    FROM temp.deck d
+    LEFT JOIN (
+        SELECT c.name, SUM(x.amount) AS owned
+        FROM user2card x
+        JOIN cards c ON c.id = x.card_id
+        WHERE x.user_id = ? AND x.amount > 0
+        AND c.name IN (SELECT name FROM temp.deck)
+        GROUP BY c.name
+    ) o ON o.name = d.name
+    LEFT JOIN (
+        SELECT c.name, MIN(COALESCE(p.usd, p.usd_foil)) AS price
+        FROM cards c
+        JOIN price_history p ON p.scryfallId = c.scryfallId
+        AND p.date = (
+            SELECT MAX(date) FROM price_history WHERE scryfallId = c.scryfallId
+        )
+        WHERE c.name IN (SELECT name FROM temp.deck)
+        GROUP BY c.name
+    ) pr ON pr.name = d.name
+    """
+    try:
+        with db:
+            fill_deck_table(db, deck)
+            curr = db.execute(query, (user.id,))
+    except Exception as e:
+        print(e, file=sys.stderr)
+        traceback.print_exc()
+        return []
+
+    return curr.fetchall()
+
+
+def get_trade_cards(db: sqlite3.Connection, user: User) -> List:
+    """
+        Query database for user's cards marked for trade.
+    """
+    query = """
+    SELECT c.name, c.rarity, c.type, c.setCode, c.colors,
+    x.amount, c.uuid, c.scryfallId
+    FROM user2card x
+    JOIN cards c ON c.id = x.card_id
+    WHERE x.user_id = ? AND x.trade = 1 AND x.amount > 0
+    """
+    try:
+        with db:
+            curr = db.execute(query, (user.id,))
+    except Exception as e:
+        print(e, file=sys.stderr)
+        traceback.print_exc()
+        return []
+
+    return curr.fetchall()
+
+
+def get_trade_wants(
+    db: sqlite3.Connection,
+    user: User,
+    deck: List[Tuple[str, int]],
+) -> List:
+    """
+        Other users' tradeable copies of the cards in a (name, amount) want
+        list. Returns user, name, set, amount, wanted and price in cents.
+    """
+    query = """
+    SELECT u.name, c.name, c.setCode, x.amount, d.wanted,
+    (
+        SELECT COALESCE(p.usd, p.usd_foil) FROM price_history p
+        WHERE p.scryfallId = c.scryfallId
+        ORDER BY p.date DESC LIMIT 1
+    )
+    FROM temp.deck d
+    JOIN cards c ON c.name = d.name
+    JOIN user2card x ON x.card_id = c.id
+    JOIN user u ON u.id = x.user_id
+    WHERE x.trade = 1 AND x.amount > 0 AND x.user_id != ?
+    ORDER BY u.name, c.name
+    """
+    try:
+        with db:
+            fill_deck_table(db, deck)
+            curr = db.execute(query, (user.id,))
+    except Exception as e:
+        print(e, file=sys.stderr)
+        traceback.print_exc()
+        return []
+
+    return curr.fetchall()
+
+
+def get_trade_offers(db: sqlite3.Connection, giver: User, taker: User) -> List:
+    """
+        Cards giver has for trade that taker has no printing of.
+        Returns name, set, amount and price in cents.
+    """
+    query = """
+    SELECT c.name, c.setCode, x.amount,
+    (
+        SELECT COALESCE(p.usd, p.usd_foil) FROM price_history p
+        WHERE p.scryfallId = c.scryfallId
+        ORDER BY p.date DESC LIMIT 1
+    )
+    FROM user2card x
+    JOIN cards c ON c.id = x.card_id
+    WHERE x.user_id = ? AND x.trade = 1 AND x.amount > 0
+    AND NOT EXISTS (
+        SELECT 1 FROM cards c2
+        JOIN user2card y ON y.card_id = c2.id
+        WHERE c2.name = c.name AND y.user_id = ? AND y.amount > 0
+    )
+    ORDER BY c.name
+    """
+    try:
+        with db:
+            curr = db.execute(query, (giver.id, taker.id))
+    except Exception as e:
+        print(e, file=sys.stderr)
+        traceback.print_exc()
+        return []
+
+    return curr.fetchall()
+
+
+def get_trade_balances(db: sqlite3.Connection, user: User) -> List:
+    """
+        For every other user the value in cents of what they have for trade
+        that user lacks and of what user has for trade that they lack,
+        closest to an even trade first.
+    """
+    query = """
+    WITH tradeable AS (
+        SELECT x.user_id, c.name, x.amount * COALESCE((
+            SELECT COALESCE(p.usd, p.usd_foil) FROM price_history p
+            WHERE p.scryfallId = c.scryfallId
+            ORDER BY p.date DESC LIMIT 1
+        ), 0) AS value
+        FROM user2card x
+        JOIN cards c ON c.id = x.card_id
+        WHERE x.trade = 1 AND x.amount > 0
+    ), gets AS (
+        SELECT t.user_id, COUNT(*) AS count, SUM(t.value) AS value
+        FROM tradeable t
+        WHERE t.user_id != :me AND NOT EXISTS (
+            SELECT 1 FROM cards c2
+            JOIN user2card y ON y.card_id = c2.id
+            WHERE c2.name = t.name AND y.user_id = :me AND y.amount > 0
+        )
+        GROUP BY t.user_id
+    ), gives AS (
+        SELECT u.id AS user_id, COUNT(*) AS count, SUM(t.value) AS value
+        FROM tradeable t
+        JOIN user u ON u.id != :me
+        WHERE t.user_id = :me AND NOT EXISTS (
+            SELECT 1 FROM cards c2
+            JOIN user2card y ON y.card_id = c2.id
+            WHERE c2.name = t.name AND y.user_id = u.id AND y.amount > 0
+        )
+        GROUP BY u.id
+    )
+    SELECT u.name,
+    COALESCE(g.count, 0), COALESCE(g.value, 0),
+    COALESCE(v.count, 0), COALESCE(v.value, 0)
+    FROM user u
+    LEFT JOIN gets g ON g.user_id = u.id
+    LEFT JOIN gives v ON v.user_id = u.id
+    WHERE u.id != :me AND (g.count OR v.count)
+    ORDER BY ABS(COALESCE(g.value, 0) - COALESCE(v.value, 0)),
+    COALESCE(g.value, 0) + COALESCE(v.value, 0) DESC
+    """
+    try:
+        with db:
+            curr = db.execute(query, {'me': user.id})
+    except Exception as e:
+        print(e, file=sys.stderr)
+        traceback.print_exc()
+        return []
+
+    return curr.fetchall()
+
+
 def get_card_uuid(db: sqlite3.Connection, card: Card) -> Tuple:
     """
         Query Database for card uuid.
@@ -208,15 +962,354 @@ def get_card_uuid(db: sqlite3.Connection, card: Card) -> Tuple:
     return curr.fetchone()
 
 
+def get_collection_value(
+    db: sqlite3.Connection,
+    user: User,
+    since: str,
+) -> List:
+    """
+        Total value of user's collection for every price snapshot date.
+        Each card counts at its latest price as of that date, so a snapshot
+        of only some cards doesn't drop the others. Prices are in cents.
+    """
+    query = """
+    WITH owned AS (
+        SELECT c.scryfallId, x.amount
+        FROM user2card x
+        JOIN cards c ON c.id = x.card_id
+        WHERE x.user_id = ? AND x.amount > 0
+    ), dates AS (
+        SELECT DISTINCT p.date
+        FROM owned o
+        JOIN price_history p ON p.scryfallId = o.scryfallId
+        WHERE p.date >= ?
+    )
+    SELECT d.date, COUNT(*), SUM(o.amount * COALESCE(p.usd, p.usd_foil, 0))
+    FROM dates d
+    JOIN owned o
+    JOIN price_history p ON p.scryfallId = o.scryfallId AND p.date = (
+        SELECT MAX(date) FROM price_history
+        WHERE scryfallId = o.scryfallId AND date <= d.date
+    )
+    GROUP BY d.date
+    ORDER BY d.date
+    """
+    try:
+        with db:
+            curr = db.execute(query, (user.id, since))
+    except Exception as e:
+        print(e, file=sys.stderr)
+        traceback.print_exc()
+        return []
+
+    return curr.fetchall()
+
+
+def get_price_movers(
+    db: sqlite3.Connection,
+    user: User,
+    since: str,
+    limit: int = 10,
+) -> List:
+    """
+        User's cards with the biggest change in value between the first
+        and last price snapshot since the given date.
+    """
+    query = """
+    WITH owned AS (
+        SELECT c.name, c.setCode, c.scryfallId, x.amount
+        FROM user2card x
+        JOIN cards c ON c.id = x.card_id
+        WHERE x.user_id = ? AND x.amount > 0
+    ), span AS (
+        SELECT p.scryfallId, MIN(p.date) AS first, MAX(p.date) AS last
+        FROM price_history p
+        JOIN owned o ON o.scryfallId = p.scryfallId
+        WHERE p.date >= ?
+        GROUP BY p.scryfallId
+    )
+    SELECT o.name, o.setCode, o.amount,
+    COALESCE(a.usd, a.usd_foil, 0) AS old,
+    COALESCE(b.usd, b.usd_foil, 0) AS new,
+    o.amount * (COALESCE(b.usd, b.usd_foil, 0)
+        - COALESCE(a.usd, a.usd_foil, 0)) AS change
+    FROM span s
+    JOIN owned o ON o.scryfallId = s.scryfallId
+    JOIN price_history a ON a.scryfallId = s.scryfallId AND a.date = s.first
+    JOIN price_history b ON b.scryfallId = s.scryfallId AND b.date = s.last
+    WHERE s.first < s.last AND change != 0
+    ORDER BY ABS(change) DESC
+    LIMIT ?
+    """
+    try:
+        with db:
+            curr = db.execute(query, (user.id, since, limit))
+    except Exception as e:
+        print(e, file=sys.stderr)
+        traceback.print_exc()
+        return []
+
+    return curr.fetchall()
+
+
+def get_node(db: sqlite3.Connection) -> str:
+    """
+        This database's node name for syncing.
+    """
+    return db.execute("SELECT name FROM node").fetchone()[0]
+
+
+def get_clock(db: sqlite3.Connection) -> List:
+    """
+        Highest change seq known from every node.
+    """
+    query = "SELECT node, MAX(seq) FROM change_log GROUP BY node"
+    try:
+        with db:
+            curr = db.execute(query)
+    except Exception as e:
+        print(e, file=sys.stderr)
+        traceback.print_exc()
+        return []
+
+    return curr.fetchall()
+
+
+def count_held_changes(db: sqlite3.Connection) -> int:
+    """
+        Synced changes waiting for cards missing from the catalog.
+    """
+    return db.execute("SELECT COUNT(*) FROM held_changes").fetchone()[0]
+
+
+def get_peers(db: sqlite3.Connection) -> List:
+    """
+        Known peers and how many changes they are missing.
+    """
+    query = """
+    SELECT p.peer, COUNT(l.seq)
+    FROM (SELECT DISTINCT peer FROM peer_clock) p
+    LEFT JOIN change_log l ON l.node != p.peer AND l.seq > COALESCE((
+        SELECT seq FROM peer_clock
+        WHERE peer = p.peer AND node = l.node
+    ), 0)
+    GROUP BY p.peer
+    """
+    try:
+        with db:
+            curr = db.execute(query)
+    except Exception as e:
+        print(e, file=sys.stderr)
+        traceback.print_exc()
+        return []
+
+    return curr.fetchall()
+
+
+def get_changes_for(db: sqlite3.Connection, peer: str = '') -> List:
+    """
+        Change log entries peer has not seen yet, all of them for an
+        unknown peer.
+    """
+    query = """
+    SELECT l.node, l.seq, l.user_name, l.card_uuid, l.delta, l.trade
+    FROM change_log l
+    WHERE l.node != ? AND l.seq > COALESCE((
+        SELECT seq FROM peer_clock
+        WHERE peer = ? AND node = l.node
+    ), 0)
+    ORDER BY l.node, l.seq
+    """
+    try:
+        with db:
+            curr = db.execute(query, (peer, peer))
+    except Exception as e:
+        print(e, file=sys.stderr)
+        traceback.print_exc()
+        return []
+
+    return curr.fetchall()
+
+
 # Update Functions
+def apply_changes(
+    db: sqlite3.Connection,
+    peer: str,
+    clock: List[Tuple],
+    changes: List[Tuple],
+    shared_baseline: bool = False,
+) -> int:
+    """
+        Merge another node's change log entries. Entries already in the log
+        are skipped, so importing the same changes twice is harmless.
+        Entries for cards missing from the catalog are held back, and
+        retried on every import and update, instead of being logged.
+        With shared_baseline the peer's baseline is taken as a copy of
+        this collection and logged without being applied.
+        Returns the number of new entries.
+    """
+    setup = """
+    CREATE TEMP TABLE IF NOT EXISTS incoming (
+        node TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        user_name TEXT NOT NULL,
+        card_uuid TEXT NOT NULL,
+        delta INTEGER NOT NULL,
+        trade INTEGER,
+        PRIMARY KEY (node, seq)
+    );
+    DELETE FROM temp.incoming;
+    """
+    hold = [
+        "INSERT OR IGNORE INTO temp.incoming SELECT * FROM main.held_changes",
+        "DELETE FROM main.held_changes",
+        """
+        DELETE FROM temp.incoming WHERE EXISTS (
+            SELECT 1 FROM change_log l
+            WHERE l.node = incoming.node AND l.seq = incoming.seq
+        )
+        """,
+        """
+        INSERT INTO main.held_changes SELECT * FROM temp.incoming i
+        WHERE NOT EXISTS (SELECT 1 FROM cards WHERE uuid = i.card_uuid)
+        """,
+        """
+        DELETE FROM temp.incoming
+        WHERE NOT EXISTS (SELECT 1 FROM cards WHERE uuid = incoming.card_uuid)
+        """,
+    ]
+    merge = [
+        "INSERT INTO change_log SELECT * FROM temp.incoming",
+        """
+        INSERT OR IGNORE INTO user (name)
+        SELECT DISTINCT user_name FROM temp.incoming
+        """,
+        f"""
+        CREATE TEMP TABLE merged AS
+        SELECT u.id AS user_id, c.id AS card_id, SUM(i.delta) AS delta,
+        (
+            SELECT i2.trade FROM temp.incoming i2
+            WHERE i2.user_name = i.user_name AND i2.card_uuid = i.card_uuid
+            AND i2.trade IS NOT NULL
+            ORDER BY i2.seq DESC LIMIT 1
+        ) AS trade
+        FROM temp.incoming i
+        JOIN user u ON u.name = i.user_name
+        JOIN cards c ON c.uuid = i.card_uuid
+        {"WHERE i.node NOT LIKE 'base-%'" if shared_baseline else ""}
+        GROUP BY u.id, c.id
+        """,
+        "UPDATE node SET replaying = 1",
+        """
+        INSERT OR IGNORE INTO user2card (user_id, card_id, amount)
+        SELECT user_id, card_id, 0 FROM temp.merged
+        """,
+        """
+        UPDATE user2card
+        SET amount = MAX(user2card.amount + m.delta, 0),
+        trade = COALESCE(m.trade, user2card.trade)
+        FROM temp.merged m
+        WHERE user2card.user_id = m.user_id AND user2card.card_id = m.card_id
+        """,
+        "UPDATE node SET replaying = 0",
+        "DROP TABLE temp.merged",
+    ]
+    clock_query = """
+    INSERT INTO peer_clock (peer, node, seq) VALUES (?, ?, ?)
+    ON CONFLICT (peer, node) DO UPDATE SET seq = MAX(seq, excluded.seq)
+    """
+    try:
+        db.executescript(setup)
+        with db:
+            db.executemany(
+                "INSERT OR IGNORE INTO temp.incoming VALUES (?, ?, ?, ?, ?, ?)",
+                changes
+            )
+            for statement in hold:
+                db.execute(statement)
+            count = db.execute("SELECT COUNT(*) FROM temp.incoming").fetchone()[0]
+            for statement in merge:
+                db.execute(statement)
+            db.executemany(
+                clock_query,
+                ((peer, node, seq) for node, seq in clock)
+            )
+    except Exception as e:
+        print(e, file=sys.stderr)
+        traceback.print_exc()
+        return 0
+
+    return count
+
+
+def reid_node(db: sqlite3.Connection) -> str:
+    """
+        Give this database a new node name, for a copy of another
+        database. The log so far stays under the old name, as both
+        copies share it.
+    """
+    with db:
+        db.execute("UPDATE node SET name = lower(hex(randomblob(8)))")
+    return get_node(db)
+
+
+def set_trade(
+    db: sqlite3.Connection,
+    user: User,
+    cards: List[Card],
+    trade: bool = True,
+) -> int:
+    """
+        Mark or unmark user's cards as available for trade.
+    """
+    query = """
+    UPDATE user2card SET trade = ?
+    WHERE user_id = ? AND card_id = (SELECT id FROM cards WHERE uuid = ?)
+    """
+    try:
+        with db:
+            curr = db.executemany(
+                query,
+                ((int(trade), user.id, card._uuid) for card in cards)
+            )
+    except Exception as e:
+        print(e, file=sys.stderr)
+        traceback.print_exc()
+        return 0
+
+    return curr.rowcount
+
+
+def add_price_history(db: sqlite3.Connection, prices: List[Tuple]) -> int:
+    """
+        Record (scryfallId, date, usd, usd_foil) prices, one row per card a day.
+    """
+    query = """
+    INSERT INTO price_history (scryfallId, date, usd, usd_foil)
+    VALUES (?, ?, ?, ?) ON CONFLICT (scryfallId, date)
+    DO UPDATE SET usd = excluded.usd, usd_foil = excluded.usd_foil
+    """
+    try:
+        with db:
+            curr = db.executemany(query, prices)
+    except Exception as e:
+        print(e, file=sys.stderr)
+        traceback.print_exc()
+        return 0
+
+    return curr.rowcount
+
+
 def update_collection(db: sqlite3.Connection, updates: List[Tuple]) -> int:
     """
-        Update database with card list to user
+        Add (user_id, card_uuid, amount) rows to the collection.
+        Expects one row per card, see utils.merge_import.
     """
     query = """
-    INSERT INTO user2card (user_id, card_uuid, amount)
-    VALUES (?, ?, ?) ON CONFLICT (user_id, card_uuid)
-    DO UPDATE SET amount = amount + ?
+    INSERT INTO user2card (user_id, card_id, amount)
+    SELECT ?1, id, ?3 FROM cards WHERE uuid = ?2
+    ON CONFLICT (user_id, card_id)
+    DO UPDATE SET amount = amount + excluded.amount
     """
     try:
         with db:
@@ -227,6 +1320,39 @@ def update_collection(db: sqlite3.Connection, updates: List[Tuple]) -> int:
 
         return 0
     return curr.rowcount
+
+
+def apply_card_deltas(db: sqlite3.Connection, deltas: List[Tuple]) -> None:
+    """
+        Apply (user_id, card_uuid, delta) amount changes in one transaction.
+        Amounts never go below zero.
+    """
+    add_query = """
+    INSERT INTO user2card (user_id, card_id, amount)
+    SELECT ?1, id, ?3 FROM cards WHERE uuid = ?2
+    ON CONFLICT (user_id, card_id)
+    DO UPDATE SET amount = amount + excluded.amount
+    """
+    remove_query = """
+    UPDATE user2card
+    SET amount = MAX(amount + ?, 0)
+    WHERE user_id = ? AND card_id = (SELECT id FROM cards WHERE uuid = ?)
+    """
+    with db:
+        db.executemany(
+            add_query,
+            (delta for delta in deltas if delta[2] > 0)
+        )
+        db.executemany(
+            remove_query,
+            (
+                (delta, user_id, card_uuid)
+                for user_id, card_uuid, delta in deltas
+                if delta < 0
+            )
+        )
+
+
 # Update card amounts
 
 # Delete Functions
@@ -241,36 +1367,275 @@ def remove_data_cards(db: sqlite3.Connection, user: User, cards: List[Card]) ->
     """
         Remove List of cards from user's database table
     """
-    for card in cards:
-        query = f"""
-        update user2card
-        set amount = case when amount > 0 then (amount - {card.amount}) else 0 end
-        where card_uuid = "{card._uuid}" and user_id = {user.id}
+    query = """
+    UPDATE user2card
+    SET amount = MAX(amount - ?, 0)
+    WHERE card_id = (SELECT id FROM cards WHERE uuid = ?) AND user_id = ?
+    """
+    try:
+        with db:
+            db.executemany(
+                query,
+                ((card.amount, card._uuid, user.id) for card in cards)
+            )
+    except Exception as e:
+        print(e, file=sys.stderr)
+        traceback.print_exc()
+
+
+def delete_empty_cards(db: sqlite3.Connection) -> int:
+    """
+        Delete user2card rows that have no cards left.
+    """
+    if not get_columns(db, 'cards'):
+        # No catalog yet, and the user2card triggers need one
+        return 0
+    query = "DELETE FROM user2card WHERE amount <= 0"
+    try:
+        with db:
+            curr = db.execute(query)
+    except Exception as e:
+        print(e, file=sys.stderr)
+        traceback.print_exc()
+        return 0
+
+    return curr.rowcount
+
+
+# Maintenance functions
+def get_database_size(db: sqlite3.Connection) -> int:
+    """
+        Size of the database file in bytes.
+    """
+    page_count = db.execute("PRAGMA page_count").fetchone()[0]
+    page_size = db.execute("PRAGMA page_size").fetchone()[0]
+    return page_count * page_size
+
+
+def optimize_database(db: sqlite3.Connection) -> bool:
+    """
+        Give free pages back to the file system and refresh the query
+        planner statistics. The first run switches the file to incremental
+        auto vacuum, which needs one full VACUUM.
+        Returns whether this run made that switch.
+    """
+    if db.in_transaction:
+        db.commit()
+    switched = db.execute("PRAGMA auto_vacuum").fetchone()[0] != 2
+    if switched:
+        db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        db.execute("VACUUM")
+    else:
+        db.execute("PRAGMA incremental_vacuum")
+    db.execute("ANALYZE")
+    db.execute("PRAGMA optimize")
+    db.commit()
+    return switched
+
+
+# Backup functions
+def slim_snapshot(db: sqlite3.Connection) -> None:
+    """
+        Turn a full copy of the database into a snapshot of just the users
+        and their cards. Cards are kept by uuid so a snapshot can be
+        restored into any later catalog. Cards the catalog doesn't have
+        yet, in unmatched_cards, are kept too.
+    """
+    unmatched = ""
+    if get_columns(db, 'unmatched_cards'):
+        unmatched = """
+        UNION ALL
+        SELECT user_id, card_uuid, trade, amount FROM unmatched_cards
         """
-        try:
-            with db:
-                db.execute(query)
-        except Exception as e:
-            print(e, file=sys.stderr)
-            traceback.print_exc()
+    script = f"""
+    BEGIN;
+    CREATE TABLE snapshot AS
+    SELECT user_id, card_uuid, MAX(trade) AS trade, SUM(amount) AS amount
+    FROM (
+        SELECT x.user_id, c.uuid AS card_uuid, x.trade, x.amount
+        FROM user2card x
+        JOIN cards c ON c.id = x.card_id
+        {unmatched}
+    )
+    GROUP BY user_id, card_uuid
+    HAVING SUM(amount) > 0 OR MAX(trade) != 0;
+    COMMIT;
+    """
+    db.executescript(script)
+    tables = [
+        name for name, in db.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+        )
+        if name not in ('user', 'snapshot') and not name.startswith('sqlite_')
+    ]
+    with db:
+        for table in tables:
+            db.execute(f'DROP TABLE "{table}"')
+        db.execute("ALTER TABLE snapshot RENAME TO user2card")
+    db.execute("VACUUM")
+
+
+def check_snapshot(db: sqlite3.Connection) -> str:
+    """
+        Return what is wrong with a snapshot database, empty if it is fine.
+    """
+    result = db.execute("PRAGMA integrity_check").fetchone()[0]
+    if result != 'ok':
+        return result
+    expected = {
+        'user': {'id', 'name'},
+        'user2card': {'user_id', 'card_uuid', 'trade', 'amount'},
+    }
+    for table, columns in expected.items():
+        missing = columns - set(get_columns(db, table))
+        if missing:
+            return f"{table} is missing {', '.join(sorted(missing))}"
+    return ''
+
+
+def restore_user_data(db: sqlite3.Connection, snapshot: Path) -> Tuple[int, int]:
+    """
+        Set every user's cards to what is in the snapshot. Changes are
+        made as updates so the change log records them. Cards the catalog
+        doesn't have go to unmatched_cards, to be added by a later update.
+        Returns the number of cards restored and the number kept aside.
+    """
+    script = """
+    BEGIN;
+    INSERT OR IGNORE INTO main.user (name) SELECT name FROM snap.user;
+
+    CREATE TEMP TABLE restored AS
+    SELECT u.id AS user_id, c.id AS card_id, x.trade, x.amount
+    FROM snap.user2card x
+    JOIN snap.user su ON su.id = x.user_id
+    JOIN main.user u ON u.name = su.name
+    JOIN main.cards c ON c.uuid = x.card_uuid;
+
+    DELETE FROM main.unmatched_cards
+    WHERE user_id IN (SELECT id FROM main.user WHERE name IN (
+        SELECT name FROM snap.user
+    ));
+    INSERT INTO main.unmatched_cards (user_id, card_uuid, trade, amount)
+    SELECT u.id, x.card_uuid, x.trade, x.amount
+    FROM snap.user2card x
+    JOIN snap.user su ON su.id = x.user_id
+    JOIN main.user u ON u.name = su.name
+    WHERE NOT EXISTS (SELECT 1 FROM main.cards c WHERE c.uuid = x.card_uuid);
+
+    UPDATE main.user2card SET amount = 0, trade = 0
+    WHERE user_id IN (SELECT id FROM main.user WHERE name IN (
+        SELECT name FROM snap.user
+    )) AND NOT EXISTS (
+        SELECT 1 FROM temp.restored r
+        WHERE r.user_id = user2card.user_id AND r.card_id = user2card.card_id
+    );
+    INSERT INTO main.user2card (user_id, card_id, trade, amount)
+    SELECT user_id, card_id, trade, amount FROM temp.restored WHERE true
+    ON CONFLICT (user_id, card_id)
+    DO UPDATE SET trade = excluded.trade, amount = excluded.amount;
+    COMMIT;
+    """
+    db.execute("ATTACH DATABASE ? AS snap", (str(snapshot),))
+    try:
+        db.executescript(script)
+        count = db.execute("SELECT COUNT(*) FROM temp.restored").fetchone()[0]
+        unmatched = db.execute("""
+        SELECT COUNT(*) FROM main.unmatched_cards
+        WHERE user_id IN (SELECT id FROM main.user WHERE name IN (
+            SELECT name FROM snap.user
+        ))
+        """).fetchone()[0]
+        db.execute("DROP TABLE temp.restored")
+    except Exception:
+        if db.in_transaction:
+            db.rollback()
+        raise
+    finally:
+        db.execute("DETACH DATABASE snap")
+    return count, unmatched
+
 
 # Transfer function
 
 
-def update_new_database(db: sqlite3.Connection, old_db: Path):
+def get_columns(db: sqlite3.Connection, table: str, schema: str = 'main') -> List[str]:
     """
-        Update the old tables into the new tables.
+        Column names of a table, empty if the table does not exist.
     """
-    query = f"""
-    ATTACH DATABASE '{old_db}' as old;
-    INSERT INTO user SELECT * FROM old.user; 
-    INSERT INTO user2card SELECT * FROM old.user2card;
+    return [
+        row[1] for row in db.execute(f"PRAGMA {schema}.table_info({table})")
+    ]
+
+
+def update_new_database(db: sqlite3.Connection, old_db: Path) -> int:
     """
+        Update the old tables into the new tables.
+        user2card rows are matched to the new catalog by uuid, from either
+        the old card ids or the card_uuid column of older databases.
+        Cards the new catalog doesn't have are kept in unmatched_cards and
+        tried again on the next update. Returns how many were kept aside.
+    """
+    unmatched = 0
     try:
+        db.execute("ATTACH DATABASE ? AS old", (str(old_db),))
         with db:
-            db.executescript(query)
-        with db:
-            db.execute("DETACH DATABASE old")
+            # Copied rows are not new changes for the change log
+            if get_columns(db, 'node', 'old'):
+                db.execute("INSERT OR REPLACE INTO main.node SELECT * FROM old.node")
+            db.execute("UPDATE main.node SET replaying = 1")
+            db.execute("INSERT INTO main.user SELECT * FROM old.user")
+            for table in (
+                'price_history', 'change_log', 'held_changes', 'peer_clock'
+            ):
+                if get_columns(db, table, 'old'):
+                    db.execute(
+                        f"INSERT INTO main.{table} SELECT * FROM old.{table}"
+                    )
+
+        sources = []
+        if 'card_uuid' in get_columns(db, 'user2card', 'old'):
+            sources.append("""
+            SELECT user_id, card_uuid, trade, amount FROM old.user2card
+            """)
+        elif get_columns(db, 'cards', 'old'):
+            sources.append("""
+            SELECT x.user_id, o.uuid, x.trade, x.amount
+            FROM old.user2card x
+            JOIN old.cards o ON o.id = x.card_id
+            """)
+        if get_columns(db, 'unmatched_cards', 'old'):
+            sources.append("""
+            SELECT user_id, card_uuid, trade, amount FROM old.unmatched_cards
+            """)
+        if sources:
+            with db:
+                db.execute(
+                    "CREATE TEMP TABLE old_cards (user_id, card_uuid, trade, amount)"
+                )
+                for source in sources:
+                    db.execute(f"INSERT INTO temp.old_cards {source}")
+                db.execute("""
+                INSERT INTO main.user2card (user_id, card_id, trade, amount)
+                SELECT o.user_id, n.id, MAX(o.trade), SUM(o.amount)
+                FROM temp.old_cards o
+                JOIN main.cards n ON n.uuid = o.card_uuid
+                GROUP BY o.user_id, n.id
+                """)
+                unmatched = db.execute("""
+                INSERT INTO main.unmatched_cards
+                SELECT o.user_id, o.card_uuid, o.trade, o.amount
+                FROM temp.old_cards o
+                WHERE o.amount > 0 AND NOT EXISTS (
+                    SELECT 1 FROM main.cards n WHERE n.uuid = o.card_uuid
+                )
+                """).rowcount
+                db.execute("DROP TABLE temp.old_cards")
     except Exception as e:
         print(e, file=sys.stderr)
         traceback.print_exc()
+    finally:
+        with db:
+            db.execute("UPDATE main.node SET replaying = 0")
+        if 'old' in [row[1] for row in db.execute("PRAGMA database_list")]:
+            db.execute("DETACH DATABASE old")
+    return unmatched
@@ -0,0 +1,63 @@
+"""
+    Tab completion of card names and set codes for MTGA
+"""
+import bisect
+import sqlite3
+from typing import Iterable, List
+import CRUD
+from user import User
+
+
+class PrefixIndex:
+    """
+        Sorted words for case insensitive prefix lookups with bisect.
+    """
+    def __init__(self, words: Iterable[str]):
+        self.words = sorted(set(words), key=str.casefold)
+        self.keys = [word.casefold() for word in self.words]
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def complete(self, prefix: str, limit: int = 200) -> List[str]:
+        prefix = prefix.casefold()
+        start = bisect.bisect_left(self.keys, prefix)
+        matches = []
+        for index in range(start, min(start + limit, len(self.keys))):
+            if not self.keys[index].startswith(prefix):
+                break
+            matches.append(self.words[index])
+        return matches
+
+
+class CollectionCompleter:
+    """
+        Prefix indexes of the user's card names and set codes, rebuilt on
+        the first lookup after the database changes.
+    """
+    def __init__(self):
+        self.version = None
+        self.indexes = {}
+
+    def refresh(self, db: sqlite3.Connection, user: User) -> None:
+        version = (
+            id(db), user.id, db.total_changes,
+            db.execute("PRAGMA data_version").fetchone()[0],
+        )
+        if version == self.version:
+            return
+        self.indexes = {
+            'name': PrefixIndex(CRUD.get_owned_names(db, user)),
+            's': PrefixIndex(CRUD.get_owned_sets(db, user)),
+        }
+        self.version = version
+
+    def complete(
+        self,
+        db: sqlite3.Connection,
+        user: User,
+        kind: str,
+        prefix: str,
+    ) -> List[str]:
+        self.refresh(db, user)
+        return self.indexes[kind].complete(prefix)
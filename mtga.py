@@ -5,19 +5,35 @@
 # Add in api from the full lists
 
 import cmd
+import sqlite3
 import pathlib
 import re
+import datetime
+import time
 from search import Query, Syntax
 from user import User
 from card import Card
 import utils
+import stats
 from options import Options
+from task import Task
+from writer import WriteQueue
+from prefetch import Prefetcher, PriceCache
+from profiling import CommandProfile
+from completion import CollectionCompleter
+from watch import DeckWatch
+from render import Renderer, MODES
 import CRUD
+import ijson
 import pyperclip
-from ast import literal_eval
 from rich import print
-from rich.console import Console
+from rich.console import Console, Group
 from rich.pretty import pprint
+from rich.table import Table
+from rich import box
+from rich.progress_bar import ProgressBar
+from rich.live import Live
+from rich.text import Text
 from typing import List
 
 
@@ -44,15 +60,14 @@ class MTGA(cmd.Cmd):
         return table
 
     def do_add(self, args):
-        """Usage: add <csv | txt> <filename>"""
-        try:
-            args = args.split()
-            if len(args) != 2:
-                if args[0] != 'csv' or args[0] != 'txt':
-                    print("[bold red]Usage: add <csv | txt> <filename>[/]")
-                    return
-        except IndexError as e:
-            print(e)
+        """Usage: add <csv | txt> <filename> [dry]"""
+        args = args.split()
+        dry = args[-1:] == ['dry']
+        if dry:
+            args = args[:-1]
+        if len(args) != 2 or args[0] not in ('csv', 'txt'):
+            print("[bold red]Usage: add <csv | txt> <filename> [dry][/]")
+            return
 
         filename = pathlib.Path(args[1])
         if args[0] == 'txt':
@@ -63,7 +78,22 @@ class MTGA(cmd.Cmd):
         if not card_list:
             return
 
-        bad_cards = utils.update_collection(self.db_conn, self.user, card_list)
+        if dry:
+            merged, bad_cards = utils.merge_import(self.db_conn, card_list)
+            table = Table(title='Import (dry run)', box=box.MINIMAL_DOUBLE_HEAD)
+            table.add_column("Card", justify='left', style='cyan')
+            table.add_column("Set (abv)", justify='left', style='bright_cyan')
+            table.add_column("Rows", justify='right', style='white')
+            table.add_column("Amount", justify='right', style='white')
+            for name, set_code, rows, amount in merged.values():
+                table.add_row(name, set_code or '', str(rows), str(amount))
+            print(table)
+            print(
+                f"{len(card_list)} rows -> {len(merged)} cards, "
+                f"{sum(entry[3] for entry in merged.values())} copies."
+            )
+        else:
+            bad_cards = self.write(utils.update_collection, self.user, card_list)
         if bad_cards:
             print('[bold red]Didn\'t load:[/]')
             pprint(bad_cards)
@@ -122,6 +152,7 @@ class MTGA(cmd.Cmd):
         """Usage:  search clip\n\tsearch <title>"""
         if args == 'clip':
             search_cards = self.search_clip()
+            self.prefetch(search_cards)
             table = self.fill_table(search_cards, "Search Results")
 
             if table.row_count:
@@ -137,6 +168,7 @@ class MTGA(cmd.Cmd):
             return
         else:
             search_cards = utils.search(self.db_conn, self.user, args)
+            self.prefetch(search_cards)
             table = self.fill_table(search_cards, "Search Results")
             if table.row_count < 1:
                 return
@@ -168,42 +200,224 @@ class MTGA(cmd.Cmd):
                         self.console.log('Index out of range.')
                         continue
 
+    def do_deck(self, args):
+        """Usage:  deck diff clip\n\tdeck diff <filename>\n\tdeck diff <clip | filename> prices"""
+        args = args.split()
+        if len(args) < 2 or args[0] != 'diff':
+            print("[bold red]Usage: deck diff <clip | filename> [prices][/]")
+            return
+        prices = 'prices' in args[2:]
+        deck = self.read_decklist(args[1])
+        if not deck:
+            return
+
+        rows = utils.deck_diff(self.db_conn, self.user, deck)
+        table, summary = self.deck_table(rows, prices)
+        print(table)
+        print(summary)
+
+    def deck_table(self, rows: list, prices: bool = False) -> tuple:
+        table = Table(title='Deck Diff', box=box.MINIMAL_DOUBLE_HEAD)
+        table.add_column("Card", justify='left', style='cyan')
+        table.add_column("Wanted", justify='right', style='white')
+        table.add_column("Owned", justify='right', style='white')
+        table.add_column("Short", justify='right', style='white')
+        table.add_column("Status", justify='left')
+        if prices:
+            table.add_column("Cost", justify='right', style='magenta')
+        counts = {'owned': 0, 'short': 0, 'missing': 0, 'unknown': 0}
+        full_total = 0
+        for name, wanted, owned, known, price in rows:
+            short = max(wanted - owned, 0)
+            if not known:
+                status = 'unknown'
+            elif not short:
+                status = 'owned'
+            elif owned:
+                status = 'short'
+            else:
+                status = 'missing'
+            counts[status] += 1
+            style = {
+                'owned': 'green', 'short': 'yellow',
+                'missing': 'red', 'unknown': 'bright_black',
+            }[status]
+            row = [
+                name, str(wanted), str(owned), str(short),
+                f'[{style}]{status}[/]',
+            ]
+            if prices:
+                cost = short * price if price is not None else None
+                full_total += cost or 0
+                row.append(f'${cost / 100:.2f}' if cost is not None else '')
+            table.add_row(*row)
+        summary = ', '.join(f'{k}: {v}' for k, v in counts.items())
+        if prices:
+            summary += f"\nCost to complete: {full_total / 100:.2f}"
+        return table, summary
+
+    def do_watch(self, args):
+        """Usage:  watch clip [prices]  (Ctrl-C to stop)"""
+        args = args.split()
+        if not args or args[0] != 'clip':
+            print("[bold red]Usage: watch clip [prices][/]")
+            return
+        prices = 'prices' in args[1:]
+        watch = DeckWatch(self.db_conn, self.user)
+
+        def render():
+            table, summary = self.deck_table(watch.rows(), prices)
+            hint = Text('Watching clipboard, Ctrl-C to stop.', style='bright_black')
+            return Group(table, summary, hint)
+
+        watch.update(pyperclip.paste())
+        with Live(render(), console=self.console, auto_refresh=False) as live:
+            try:
+                while True:
+                    time.sleep(0.5)
+                    if watch.update(pyperclip.paste()):
+                        live.update(render(), refresh=True)
+            except KeyboardInterrupt:
+                pass
+
+    def read_decklist(self, source: str) -> dict:
+        if source == 'clip':
+            text = pyperclip.paste()
+        else:
+            try:
+                text = pathlib.Path(source).read_text()
+            except OSError as e:
+                print(e)
+                return {}
+        deck = utils.parse_decklist(text)
+        if not deck:
+            print("[yellow]No cards found in decklist.[/]")
+        return deck
+
+    def offers_table(self, title: str, offers: list) -> Table:
+        table = Table(title=title, box=box.MINIMAL_DOUBLE_HEAD)
+        table.add_column("Card", justify='left', style='cyan')
+        table.add_column("Set (abv)", justify='left', style='bright_cyan')
+        table.add_column("Amount", justify='right', style='white')
+        table.add_column("Price", justify='right', style='magenta')
+        for name, set_code, amount, price in offers:
+            table.add_row(
+                name, set_code, str(amount),
+                f'${price / 100:.2f}' if price is not None else '',
+            )
+        return table
+
+    def do_trade(self, args):
+        """Usage:  trade list\n\ttrade <mark | unmark>  (cards in hand)
+        trade match\n\ttrade match user <username>\n\ttrade match <clip | filename>"""
+        args = args.split()
+        if not args or args[0] == 'list':
+            cards = utils.trade_cards(self.db_conn, self.user)
+            if not cards:
+                print("[yellow]No cards marked for trade.[/]")
+                return
+            print(self.fill_table(cards, 'For Trade'))
+        elif args[0] in ('mark', 'unmark'):
+            if not self.cards_in_hand:
+                print("[yellow]No cards in hand currently.[/]")
+                return
+            count = self.write(
+                utils.mark_trade, self.user, self.cards_in_hand,
+                args[0] == 'mark',
+            ) or 0
+            print(f'{args[0].capitalize()}ed {count} cards for trade.')
+        elif args[0] == 'match' and len(args) == 1:
+            rows = utils.trade_balances(self.db_conn, self.user)
+            if not rows:
+                print("[yellow]No trades found.[/]")
+                return
+            table = Table(title='Trade Matches', box=box.MINIMAL_DOUBLE_HEAD)
+            table.add_column("User", justify='left', style='cyan')
+            table.add_column("They Have", justify='right', style='white')
+            table.add_column("Value", justify='right', style='magenta')
+            table.add_column("You Have", justify='right', style='white')
+            table.add_column("Value", justify='right', style='magenta')
+            table.add_column("Balance", justify='right')
+            for name, get_count, get_value, give_count, give_value in rows:
+                balance = (get_value - give_value) / 100
+                table.add_row(
+                    name.capitalize(), str(get_count), f'${get_value / 100:.2f}',
+                    str(give_count), f'${give_value / 100:.2f}',
+                    f'{balance:+.2f}',
+                )
+            print(table)
+        elif args[0] == 'match' and args[1] == 'user':
+            if len(args) != 3:
+                print("[bold red]Usage: trade match user <username>[/]")
+                return
+            users = utils.query_users(self.db_conn)
+            if args[2].lower() not in users:
+                print(f"[red]No user '{args[2]}'.[/]")
+                return
+            other = User(args[2].lower(), users[args[2].lower()])
+            theirs = utils.trade_offers(self.db_conn, other, self.user)
+            mine = utils.trade_offers(self.db_conn, self.user, other)
+            print(self.offers_table(f'{other.username.capitalize()} Has', theirs))
+            print(self.offers_table('You Have', mine))
+            balance = sum(a * (p or 0) for _, _, a, p in theirs) - sum(
+                a * (p or 0) for _, _, a, p in mine
+            )
+            print(f"Balance: {balance / 100:+.2f}")
+        elif args[0] == 'match' and len(args) == 2:
+            deck = self.read_decklist(args[1])
+            if not deck:
+                return
+            offers = utils.trade_wants(self.db_conn, self.user, deck)
+            if not offers:
+                print("[yellow]Nobody has those cards for trade.[/]")
+                return
+            for name, rows in offers.items():
+                print(self.offers_table(
+                    f'{name.capitalize()} Has',
+                    [(card, set_code, amount, price)
+                     for card, set_code, amount, _, price in rows],
+                ))
+        else:
+            print("[bold red]Usage: trade <list | mark | unmark | match>[/]")
+
+    def complete_search(self, text, line, begidx, endidx):
+        """
+            Complete name:<card name> and s:<set code> from the collection.
+        """
+        match = re.search(r'(name|s)([:=])("?)([^"]*)$', line[:endidx])
+        if not match or (not match.group(3) and ' ' in match.group(4)):
+            return []
+        kind, quoted, prefix = match.group(1), match.group(3), match.group(4)
+        value_start = match.start(3)
+        completions = []
+        for word in self.completer.complete(self.db_conn, self.user, kind, prefix):
+            if quoted or ' ' in word:
+                word = f'"{word}"'
+            completions.append((line[:value_start] + word)[begidx:])
+        return completions
+
+    def prefetch(self, cards: List[Card]) -> None:
+        self.prefetcher.enqueue(card._scry_id for card in cards)
+
     def do_cih(self, args):
         if not self.cards_in_hand:
             print("[yellow]No cards in hand currently.[/]")
             return
         if not args or args == 'print':
-            table = Card.make_table(title='Cards in Hand', price=False)
-            for index, card in enumerate(self.cards_in_hand):
-                table.add_row(
-                    str(index + 1),
-                    card.name, utils.get_color(card),
-                    card.set, card.type, card.rarity,
-                    f'{card.amount}'
-                )
-            print(table)
+            self.renderer.cards(self.cards_in_hand, title='Cards in Hand')
         elif args == 'prices':
-            utils.get_prices(self.cards_in_hand)
-            table = Card.make_table(price=True)
-            full_total = 0.0
-            for index, card in enumerate(self.cards_in_hand):
-                total = card.amount * (
-                    card.price if card.price > 0 else card.foil_price
-                )
-                full_total += total
-                table.add_row(
-                    str(index + 1),
-                    card.name, utils.get_color(card),
-                    card.set, card.type, card.rarity,
-                    f'{card.amount}', f'${card.price:.2f}',
-                    f'${card.foil_price:.2f}', f'${total:.2f}',
-                )
-            print(table)
+            utils.get_prices(self.cards_in_hand, self.prefetcher.cache)
+            utils.record_prices(self.db_conn, self.cards_in_hand)
+            full_total = self.renderer.cards(
+                self.cards_in_hand, title='Cards in Hand', price=True
+            )
             print(f"Total Card Amount: {full_total:.2f}")
         elif args == 'remove':
             choice = input("Hand or Database? [H or D]?:> ")
             if choice.lower() == 'd':
-                utils.remove_cards(self.db_conn, self.user, self.cards_in_hand)
+                for card in self.cards_in_hand:
+                    self.writer.add(self.user.id, card._uuid, -card.amount)
+                self.flush()
                 self.cards_in_hand = []
             elif choice.lower() == 'h':
                 self.cards_in_hand = []
@@ -211,90 +425,407 @@ class MTGA(cmd.Cmd):
                 self.console.log(f'Invalid input "{choice}"')
 
     def do_prices(self, args):
-        """Usage:  print\n\tprint limit=<num>"""
-        try:
-            args = dict(
-                (k, literal_eval(v))
-                for k, v in (
-                    pair.split('=')
-                    for pair in args.split()
-                )
-            )
-        except Exception:
-            args = {}
+        """Usage:  prices [local]\n\tprices [local] limit=<num>"""
+        local = 'local' in args.split()
+        args = utils.parse_kwargs(args.replace('local', ''))
 
         if args and 'limit' not in args.keys():
-            print('Usage:  print\n\tprint limit=<num>')
+            print('Usage:  prices [local]\n\tprices [local] limit=<num>')
             return
-        cards = utils.query_collection(self.db_conn, self.user, **args)
-
-        utils.get_prices(cards)
-        table = Card.make_table(price=True)
-        full_total = 0.0
-        for index, card in enumerate(cards):
-            total = card.amount * (
-                card.price if card.price > 0 else card.foil_price
+        if local:
+            cards = utils.query_collection_prices(
+                self.db_conn, self.user, **args
             )
-            full_total += total
+        else:
+            cards = utils.query_collection(self.db_conn, self.user, **args)
+            utils.get_prices(cards, self.prefetcher.cache)
+            utils.record_prices(self.db_conn, cards)
+        full_total = self.renderer.cards(cards, price=True)
+        print(f"Total Card Amount: {full_total:.2f}")
+
+    def do_value(self, args):
+        """Usage:  value\n\tvalue days=<num>"""
+        args = utils.parse_kwargs(args)
+        rows = utils.collection_value(
+            self.db_conn, self.user, days=args.get('days', 30)
+        )
+        if not rows:
+            print("[yellow]No price history yet. Run 'prices' first.[/]")
+            return
+        table = Table(title='Collection Value', box=box.MINIMAL_DOUBLE_HEAD)
+        table.add_column("Date", justify='left', style='white')
+        table.add_column("Cards Priced", justify='right', style='cyan')
+        table.add_column("Value", justify='right', style='magenta')
+        table.add_column("Change", justify='right')
+        previous = None
+        for date, priced, value in rows:
+            change = ''
+            if previous is not None:
+                diff = (value - previous) / 100
+                color = 'green' if diff >= 0 else 'red'
+                change = f'[{color}]{diff:+.2f}[/]'
+            table.add_row(date, str(priced), f'${value / 100:.2f}', change)
+            previous = value
+        print(table)
+
+    def do_movers(self, args):
+        """Usage:  movers\n\tmovers days=<num> limit=<num>"""
+        args = utils.parse_kwargs(args)
+        rows = utils.price_movers(
+            self.db_conn, self.user,
+            days=args.get('days', 7),
+            limit=args.get('limit', 10),
+        )
+        if not rows:
+            print("[yellow]No price changes in that time.[/]")
+            return
+        table = Table(title='Biggest Movers', box=box.MINIMAL_DOUBLE_HEAD)
+        table.add_column("Card", justify='left', style='cyan')
+        table.add_column("Set (abv)", justify='left', style='bright_cyan')
+        table.add_column("Amount", justify='left', style='white')
+        table.add_column("Old", justify='right', style='magenta')
+        table.add_column("New", justify='right', style='magenta')
+        table.add_column("Change", justify='right')
+        for name, set_code, amount, old, new, change in rows:
+            color = 'green' if change >= 0 else 'red'
             table.add_row(
-                str(index + 1),
-                card.name, utils.get_color(card),
-                card.set, card.type, card.rarity,
-                f'{card.amount}', f'${card.price:.2f}',
-                f'${card.foil_price:.2f}', f'${total:.2f}',
+                name, set_code, str(amount),
+                f'${old / 100:.2f}', f'${new / 100:.2f}',
+                f'[{color}]{change / 100:+.2f}[/]',
             )
         print(table)
-        print(f"Total Card Amount: {full_total:.2f}")
+
+    def group_table(self, title: str, column: str, rows: list) -> Table:
+        table = Table(title=title, box=box.MINIMAL_DOUBLE_HEAD)
+        table.add_column(column, justify='left', style='cyan')
+        table.add_column("Copies", justify='right', style='white')
+        table.add_column("Value", justify='right', style='magenta')
+        for group, copies, value in rows:
+            table.add_row(str(group), str(copies), f'${value / 100:.2f}')
+        return table
+
+    def do_stats(self, args):
+        """Usage:  stats collection"""
+        if args != 'collection':
+            print("[bold red]Usage: stats collection[/]")
+            return
+        cards = stats.load_collection(self.db_conn, self.user)
+        if not len(cards['amount']):
+            print("[yellow]No cards in collection.[/]")
+            return
+        colors = dict((k, v[0]) for k, v in utils.colors.items())
+        colors['Multi'] = 'Multicolor'
+        print(self.group_table(
+            'Value by Set', 'Set (abv)', stats.value_by(cards, 'set')
+        ))
+        print(self.group_table(
+            'Value by Color', 'Color',
+            [(colors[c], n, v) for c, n, v in stats.value_by_color(cards)]
+        ))
+        print(self.group_table(
+            'Value by Rarity', 'Rarity', stats.value_by(cards, 'rarity')
+        ))
+
+        curve = Table(title='Mana Curve', box=box.MINIMAL_DOUBLE_HEAD)
+        curve.add_column("Mana Value", justify='left', style='cyan')
+        curve.add_column("Copies", justify='right', style='white')
+        for mana, copies in enumerate(stats.mana_curve(cards)):
+            label = f'{mana}+' if mana == stats.CURVE_MAX else str(mana)
+            curve.add_row(label, str(copies))
+        print(curve)
+
+        percentiles = stats.price_percentiles(cards)
+        if percentiles:
+            table = Table(title='Price Percentiles', box=box.MINIMAL_DOUBLE_HEAD)
+            table.add_column("Percentile", justify='left', style='cyan')
+            table.add_column("Price", justify='right', style='magenta')
+            for percentile, price in percentiles:
+                table.add_row(f'{percentile}%', f'${price / 100:.2f}')
+            print(table)
+        total = int((cards['amount'] * cards['price']).sum())
+        print(
+            f"Copies: {cards['amount'].sum()}  "
+            f"Unique: {len(cards['amount'])}  "
+            f"Total Value: {total / 100:.2f}"
+        )
+
+    def do_summary(self, args):
+        """Usage:  summary [set | color | rarity]"""
+        by = args.strip() or 'set'
+        if by not in utils.SUMMARY_COLUMNS:
+            print("[bold red]Usage: summary [set | color | rarity][/]")
+            return
+        rows = utils.collection_summary(self.db_conn, self.user, by)
+        if not rows:
+            print("[yellow]No cards in collection.[/]")
+            return
+        table = Table(title=f'Summary by {by}', box=box.MINIMAL_DOUBLE_HEAD)
+        table.add_column(by.capitalize(), justify='left', style='cyan')
+        table.add_column("Copies", justify='right', style='white')
+        table.add_column("Unique", justify='right', style='white')
+        table.add_column("Value", justify='right', style='magenta')
+        for group, copies, uniques, value in rows:
+            if by == 'color':
+                group = utils.color_text(group or 'C')
+            table.add_row(group, str(copies), str(uniques), f'${value / 100:.2f}')
+        print(table)
+        print(
+            f"Copies: {sum(row[1] for row in rows)}  "
+            f"Unique: {sum(row[2] for row in rows)}  "
+            f"Total Value: {sum(row[3] for row in rows) / 100:.2f}"
+        )
 
     def do_print(self, args):
         """
         Print User collection from database
-        print or print limit=<num>
+        print or print limit=<num> (limit=-1 for everything)
         """
-        try:
-            args = dict(
-                (k, literal_eval(v))
-                for k, v in (
-                    pair.split('=')
-                    for pair in args.split()
-                )
-            )
-        except Exception:
-            args = {}
+        args = utils.parse_kwargs(args)
 
         if args and 'limit' not in args.keys():
             print('Usage:  print\n\tprint limit=<num>')
             return
-        cards = utils.query_collection(self.db_conn, self.user, **args)
-        table = Card.make_table(price=False, search=False)
-        index = 0
-        for index, card in enumerate(cards):
-            table.add_row(
-                str(index + 1),
-                card.name, utils.get_color(card),
-                card.set, card.type,
-                card.rarity, str(card.amount)
-            )
-        print(table)
+        cards = utils.iter_collection(self.db_conn, self.user, **args)
+        self.renderer.cards(cards)
+
+    def do_output(self, args):
+        """Usage:  output <table | tsv>"""
+        if args not in MODES:
+            print(f"Output is {self.renderer.mode}. Usage: output <table | tsv>")
+            return
+        self.renderer.mode = args
 
     def do_update(self, args):
+        """Usage:  update\n\tupdate full  (keep the whole AllPrintings file)
+        update status\n\tupdate prices [mtgjson | scryfall | <filename>]"""
+        if args.startswith('prices'):
+            source = args.split()[1] if len(args.split()) > 1 else 'mtgjson'
+            try:
+                with self.console.status(f'Loading prices from {source}...'):
+                    total = utils.update_prices(self.db_conn, source)
+            except (ConnectionError, FileNotFoundError) as e:
+                self.console.log(e)
+                return
+            except ijson.JSONError as e:
+                self.console.log(f'[red]Bad price file {source}: {e}[/]')
+                return
+            print(f'Loaded {total} prices.')
+            return
+        if args == 'status':
+            if not self.update_task:
+                print("[yellow]No update running.[/]")
+                return
+            completed, total = self.update_task.progress
+            self.console.print(
+                ProgressBar(total=total or None, completed=completed),
+                f'{completed / 1_000_000:.1f}/{total / 1_000_000:.1f} MB'
+            )
+            return
+        if self.update_task:
+            print("[yellow]Update already running. See 'update status'.[/]")
+            return
+        keep_full = self.options.full_catalog if args == 'full' else None
+        self.update_task = Task(
+            'update', utils.prepare_update, keep_full, progress=True
+        )
+        self.update_task.start()
+        print("[green]Downloading update in the background...[/]")
+
+    def finish_update(self):
+        """
+            Swap in the downloaded database once the update task is done.
+            Only called between commands so nothing is using the connection.
+        """
+        if not self.update_task or not self.update_task.done():
+            return
+        task, self.update_task = self.update_task, None
         try:
-            filename = utils.download_update()
+            filename = task.get()
         except ConnectionError as e:
             self.console.log(f"{e}. Check your connection settings.")
-        self.db_conn = utils.update_database(
-            self.db_conn,
-            self.options.database,
-            filename,
+            utils.discard_update(self.options.database.parent)
+            return
+        except Exception as e:
+            self.console.log(f"[red]Update failed: {e!r}[/]")
+            utils.discard_update(self.options.database.parent)
+            return
+        # The writer has its own connection to the file being replaced
+        self.writer.close()
+        with self.console.status('Updating database...'):
+            self.db_conn = utils.update_database(
+                self.db_conn,
+                self.options.database,
+                filename,
+            )
+        self.writer = WriteQueue(self.options.database)
+        self.writer.start()
+        self.console.log('Database updated.')
+        if self.options.auto_maintain:
+            self.do_maintain('')
+
+    def finish_backup(self):
+        if not self.backup_task or not self.backup_task.done():
+            return
+        task, self.backup_task = self.backup_task, None
+        try:
+            self.console.log(f'User data backed up to {task.get()}')
+        except (OSError, sqlite3.Error) as e:
+            self.console.log(f'[red]Backup failed: {e}[/]')
+        except Exception as e:
+            self.console.log(f'[red]Backup failed: {e!r}[/]')
+
+    def do_backup(self, args):
+        """Back up users and their cards to Data in the background"""
+        if self.backup_task:
+            print("[yellow]Backup already running.[/]")
+            return
+        self.backup_task = Task(
+            'backup', utils.backup_user_data, self.options.database,
+            progress=True
         )
+        self.backup_task.start()
+
+    def do_restore(self, args):
+        """Usage:  restore\n\trestore <filename>  (default is the newest backup)"""
+        try:
+            if args:
+                backup = pathlib.Path(args)
+            else:
+                backup = utils.latest_user_backup(self.options.database.parent)
+            choice = input(f"Restore users and cards from {backup.name}? [y/N]> ")
+            if choice.lower() != 'y':
+                return
+            count, unmatched = utils.restore_user_data(self.db_conn, backup)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            print(f'[red]{e}[/]')
+            return
+        print(f'Restored {count} cards.')
+        if unmatched:
+            print(
+                f'[yellow]{unmatched} cards are not in the catalog. '
+                'They are kept and will be added back once a catalog has them.[/]'
+            )
+
+    def status_line(self) -> str:
+        if self.update_task:
+            return f'[update {self.update_task.percent}%] '
+        if self.backup_task:
+            return f'[backup {self.backup_task.percent}%] '
+        return ''
+
+    def precmd(self, line):
+        self.finish_update()
+        self.finish_backup()
+        args = line.split(maxsplit=2)
+        # 'profile' and 'profile dump' alone fall through to the usage message
+        if args and args[0] == 'profile' and args[1:] not in ([], ['dump']):
+            dump = None
+            if args[1] == 'dump':
+                command = args[2]
+                name = re.sub(r'\W+', '_', command.split()[0])
+                dump = self.options.database.with_name(
+                    f"profile-{name}-{datetime.datetime.now().strftime('%m-%d_%H-%M-%S')}.prof"
+                )
+            else:
+                command = line.split(maxsplit=1)[1]
+            self.profile = CommandProfile(command, dump)
+            self.profile.start(self.db_conn)
+            return command
+        return line
+
+    def postcmd(self, stop, line):
+        if not stop:
+            # Nothing a command wrote is left pending when it returns
+            self.flush()
+        if self.profile:
+            profile, self.profile = self.profile, None
+            profile.stop()
+            profile.report(self.console)
+        self.prompt = self.status_line() + MTGA.prompt
+        return stop
+
+    def do_profile(self, args):
+        """Usage:  profile <command ...>\n\tprofile dump <command ...>  (also write a .prof file to Data)"""
+        print("[bold red]Usage: profile [dump] <command ...>[/]")
+
+    def do_sync(self, args):
+        """Usage:  sync status\n\tsync export <filename> [peer]
+        sync import <filename> [shared]  (shared: both started as copies of one database)
+        sync reid  (run on a copied database before syncing it)"""
+        args = args.split()
+        if not args or args[0] == 'status':
+            print(f'This node: {CRUD.get_node(self.db_conn)}')
+            for peer, missing in CRUD.get_peers(self.db_conn):
+                print(f'Peer {peer}: {missing} changes to send')
+            held = CRUD.count_held_changes(self.db_conn)
+            if held:
+                print(f'{held} changes wait for cards missing from the catalog')
+            return
+        if args[0] == 'reid':
+            choice = input("Only do this on a copied database. Continue? [y/N]> ")
+            if choice.lower() == 'y':
+                print(f'This node: {CRUD.reid_node(self.db_conn)}')
+            return
+        if len(args) < 2 or args[0] not in ('export', 'import'):
+            print("[bold red]Usage: sync <status | export | import | reid> <filename> [peer][/]")
+            return
+        filename = pathlib.Path(args[1])
+        try:
+            if args[0] == 'export':
+                peer = utils.find_peer(self.db_conn, args[2]) if len(args) > 2 else ''
+                count = utils.sync_export(self.db_conn, filename, peer)
+                print(f'Exported {count} changes to {filename}.')
+            else:
+                shared = args[2:] == ['shared']
+                count = utils.sync_import(self.db_conn, filename, shared)
+                print(f'Imported {count} new changes.')
+                held = CRUD.count_held_changes(self.db_conn)
+                if held:
+                    print(f'[yellow]{held} changes wait for cards missing from the catalog.[/]')
+        except (OSError, ValueError, KeyError) as e:
+            print(f'[red]{e}[/]')
+
+    def do_maintain(self, args):
+        """
+        Delete empty collection rows, prune old backups in Data and
+        compact the database
+        """
+        with self.console.status('Maintaining database...'):
+            report = utils.maintain(self.db_conn, self.options)
+        print(
+            f"Deleted {report['rows']} empty rows. "
+            f"Reclaimed {report['database'] / 1024 / 1024:.1f} MB from the "
+            f"database and {report['backups'] / 1024 / 1024:.1f} MB of backups."
+        )
+        if report['switched']:
+            print("Database switched to incremental vacuum, later runs reclaim space faster.")
 
     def do_exit(self, args):
+        if self.update_task:
+            print("[yellow]Update cancelled.[/]")
+        self.writer.close()
         CRUD.close_db_connection(self.db_conn)
         return True
 
     def do_quit(self, args):
-        CRUD.close_db_connection(self.db_conn)
-        return True
+        return self.do_exit(args)
+
+    def write(self, func, *args):
+        """
+            Run func(db, *args) on the write queue and wait until it is
+            durable. Errors are logged and None returned.
+        """
+        try:
+            return self.writer.submit(func, *args).result()
+        except Exception as e:
+            self.console.log(f'[red]Write failed: {e!r}[/]')
+            return None
+
+    def flush(self):
+        try:
+            self.writer.flush()
+        except Exception as e:
+            self.console.log(f'[red]Write failed: {e!r}[/]')
 
     # User Functions
     def add_user(self):
@@ -306,7 +837,7 @@ class MTGA(cmd.Cmd):
                 user_input = input(f"Enter username:\n{MTGA.prompt}")
                 choice = input(f"Add '{user_input}', are you sure? [Y/n]:>")
                 if not choice or choice.lower() == 'y':
-                    return utils.make_user(self.db_conn, user_input)
+                    return self.write(utils.make_user, user_input)
         except (EOFError, KeyboardInterrupt):
             return None
 
@@ -352,12 +883,22 @@ class MTGA(cmd.Cmd):
 
     def preloop(self):
         self.console = Console()
+        self.renderer = Renderer(self.console)
+        self.completer = CollectionCompleter()
         self.options = Options(utils.WORKING_DIR)
         self.cards_in_hand = []
+        self.update_task = None
+        self.backup_task = None
+        self.profile = None
+        self.prefetcher = Prefetcher(PriceCache(self.options.price_cache_size))
+        self.prefetcher.start()
         try:
             self.db_conn = utils.database_init(self.options)
         except Exception as e:
             raise SystemExit(e)
+        # The shell's own writes go through the same queue as the server's
+        self.writer = WriteQueue(self.options.database)
+        self.writer.start()
         self.user = self.user_shell()
         if not self.user or self.user.id < 0:
             raise SystemExit("\nExiting MTGApp...")
@@ -372,6 +913,7 @@ class MTGA(cmd.Cmd):
         if self.user.id < 0:
             self.console.log("User doesn't exist try again.")
         MTGA.update_prompt(self.user)
+        self.prompt = MTGA.prompt
 
 
 if __name__ == "__main__":
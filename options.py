@@ -6,4 +6,13 @@ from pathlib import Path
 
 class Options:
     def __init__(self, working: Path):
-        self.database = Path(working, 'Data', 'MTGDatabase.sqlite')
\ No newline at end of file
+        self.database = Path(working, 'Data', 'MTGDatabase.sqlite')
+        self.full_catalog = Path(working, 'Data', 'AllPrintings.sqlite')
+        # Old database backups to keep in Data after updates
+        self.backups_kept = 3
+        # User data backups to keep in Data
+        self.user_backups_kept = 10
+        # Prices kept from background fetches
+        self.price_cache_size = 5000
+        # Run maintenance after every update
+        self.auto_maintain = True
@@ -0,0 +1,87 @@
+"""
+    Price prefetching for MTGA
+
+    Cards that are searched for or put in hand are likely to be priced
+    next, so their prices are fetched from Scryfall in the background and
+    kept in a small cache that get_prices reads first.
+"""
+import queue
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional, Tuple
+import utils
+
+Price = Tuple[Optional[float], Optional[float]]
+
+
+class PriceCache:
+    """
+        Least recently used cache of scryfallId -> (usd, usd_foil).
+        Entries older than max_age seconds are treated as missing.
+    """
+    def __init__(self, size: int = 5000, max_age: float = 3600):
+        self.size = size
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.prices: OrderedDict = OrderedDict()
+
+    def get(self, scry_id: str) -> Optional[Price]:
+        with self.lock:
+            entry = self.prices.get(scry_id)
+            if entry is None:
+                return None
+            added, price = entry
+            if time.monotonic() - added > self.max_age:
+                del self.prices[scry_id]
+                return None
+            self.prices.move_to_end(scry_id)
+            return price
+
+    def put(self, scry_id: str, price: Price) -> None:
+        with self.lock:
+            self.prices[scry_id] = (time.monotonic(), price)
+            self.prices.move_to_end(scry_id)
+            while len(self.prices) > self.size:
+                self.prices.popitem(last=False)
+
+    def __contains__(self, scry_id: str) -> bool:
+        return self.get(scry_id) is not None
+
+
+class Prefetcher(threading.Thread):
+    def __init__(self, cache: PriceCache, batch_size: int = 75):
+        super().__init__(name='price-prefetch', daemon=True)
+        self.cache = cache
+        self.batch_size = batch_size
+        self.ids = queue.Queue()
+
+    def enqueue(self, scry_ids: Iterable[str]) -> None:
+        """
+            Queue scryfallIds to be priced when the thread gets to them.
+        """
+        for scry_id in scry_ids:
+            if scry_id and scry_id not in self.cache:
+                self.ids.put(scry_id)
+
+    def next_batch(self) -> list:
+        batch = {self.ids.get()}
+        while len(batch) < self.batch_size:
+            try:
+                batch.add(self.ids.get_nowait())
+            except queue.Empty:
+                break
+        return [scry_id for scry_id in batch if scry_id not in self.cache]
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            if not batch:
+                continue
+            try:
+                prices, _ = utils.fetch_prices(batch)
+            except (ConnectionError, ValueError):
+                # Only a guess at what is needed next, get_prices will retry
+                continue
+            for scry_id, price in prices.items():
+                self.cache.put(scry_id, price)
@@ -0,0 +1,70 @@
+"""
+    Profiling of single shell commands for MTGA
+"""
+import cProfile
+import io
+import pstats
+import re
+import sqlite3
+import time
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+from rich.console import Console
+from rich.table import Table
+from rich import box
+
+
+class CommandProfile:
+    """
+        cProfile, tracemalloc and an SQL trace around one command.
+    """
+    def __init__(self, line: str, dump: Path = None):
+        self.line = line
+        self.dump = dump
+        self.profiler = cProfile.Profile()
+        self.statements = Counter()
+        self.db = None
+        self.elapsed = 0.0
+        self.peak = 0
+
+    def trace(self, statement: str) -> None:
+        # Collapse whitespace so multi line queries group and print cleanly
+        self.statements[re.sub(r'\s+', ' ', statement).strip()] += 1
+
+    def start(self, db: sqlite3.Connection) -> None:
+        self.db = db
+        db.set_trace_callback(self.trace)
+        tracemalloc.start()
+        self.elapsed = time.perf_counter()
+        self.profiler.enable()
+
+    def stop(self) -> None:
+        self.profiler.disable()
+        self.elapsed = time.perf_counter() - self.elapsed
+        _, self.peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.db.set_trace_callback(None)
+        if self.dump:
+            self.profiler.dump_stats(self.dump)
+
+    def report(self, console: Console, top: int = 15) -> None:
+        stream = io.StringIO()
+        stats = pstats.Stats(self.profiler, stream=stream)
+        stats.strip_dirs().sort_stats('cumulative').print_stats(top)
+        console.print(stream.getvalue(), markup=False, highlight=False)
+
+        table = Table(title='SQL Statements', box=box.MINIMAL_DOUBLE_HEAD)
+        table.add_column("Count", justify='right', style='white')
+        table.add_column("Statement", justify='left', style='cyan')
+        for statement, count in self.statements.most_common(top):
+            table.add_row(str(count), statement[:200])
+        console.print(table)
+
+        console.print(
+            f"'{self.line}' took {self.elapsed:.3f}s, "
+            f"{sum(self.statements.values())} SQL statements, "
+            f"peak memory {self.peak / 1024 / 1024:.1f} MB"
+        )
+        if self.dump:
+            console.print(f'Profile written to {self.dump}')
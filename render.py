@@ -0,0 +1,132 @@
+"""
+    Card list rendering for MTGA
+
+    Rows are written in chunks as they come so large collections never
+    have to be held in one Rich table. 'tsv' mode skips Rich altogether.
+"""
+import sys
+from typing import Iterable, List, Optional
+from rich.cells import cell_len
+from rich.console import Console
+from rich.table import Table
+from rich.text import Text
+from card import Card
+import utils
+
+CHUNK_SIZE = 500
+MODES = ['table', 'tsv']
+
+
+class Renderer:
+    def __init__(self, console: Console, mode: str = 'table'):
+        self.console = console
+        self.mode = mode
+
+    def cards(
+        self,
+        cards: Iterable[Card],
+        title: str = 'Collection',
+        price: bool = False,
+    ) -> float:
+        """
+            Render cards and return their total value when priced.
+        """
+        if self.mode == 'tsv':
+            return self._tsv(cards, price)
+        return self._table(cards, title, price)
+
+    def _rows(self, cards: Iterable[Card], price: bool):
+        for index, card in enumerate(cards):
+            row = [
+                str(index + 1), card.name, card.color or 'C', card.set,
+                card.type, card.rarity, str(card.amount),
+            ]
+            total = 0.0
+            if price:
+                total = card.amount * (
+                    card.price if card.price > 0 else card.foil_price
+                )
+                row += [
+                    f'{card.price:.2f}', f'{card.foil_price:.2f}', f'{total:.2f}'
+                ]
+            yield row, total
+
+    def _make_table(self, title: str, price: bool):
+        table = Card.make_table(title=title, price=price, request=False)
+        if price:
+            table.add_column("Total", justify='left', style='white')
+        return table
+
+    def _widths(self, table: Table, rows: List[list]) -> List[int]:
+        """
+            Widest cell of each column, header included.
+        """
+        widths = [cell_len(column.header) for column in table.columns]
+        for row in rows:
+            for index, cell in enumerate(row):
+                width = cell.cell_len if isinstance(cell, Text) else cell_len(cell)
+                widths[index] = max(widths[index], width)
+        return widths
+
+    def _chunk(
+        self,
+        rows: List[list],
+        title: str,
+        price: bool,
+        widths: Optional[List[int]],
+    ) -> List[int]:
+        """
+            Print one chunk of rows and return its column widths. Later
+            chunks continue the first without a title or header, with its
+            column widths so they line up under it.
+        """
+        if widths is None:
+            table = self._make_table(title, price)
+            widths = self._widths(table, rows)
+        else:
+            table = self._make_table(None, price)
+            table.show_header = False
+        for column, width in zip(table.columns, widths):
+            # Longer cells in later chunks fold rather than lose characters
+            column.width = width
+            column.overflow = 'fold'
+        for row in rows:
+            table.add_row(*row)
+        self.console.print(table)
+        return widths
+
+    def _table(self, cards: Iterable[Card], title: str, price: bool) -> float:
+        full_total = 0.0
+        widths = None
+        rows = []
+        for row, total in self._rows(cards, price):
+            full_total += total
+            row[2] = utils.color_text(row[2])
+            if price:
+                row[7:] = [f'${value}' for value in row[7:]]
+            rows.append(row)
+            if len(rows) >= CHUNK_SIZE:
+                widths = self._chunk(rows, title, price, widths)
+                rows = []
+        if rows:
+            self._chunk(rows, title, price, widths)
+        return full_total
+
+    def _tsv(self, cards: Iterable[Card], price: bool) -> float:
+        header = ['Index', 'Card', 'Color', 'Set', 'Type', 'Rarity', 'Amount']
+        if price:
+            header += ['Price', 'Foil Price', 'Total']
+        out = sys.stdout
+        out.write('\t'.join(header) + '\n')
+        full_total = 0.0
+        lines = []
+        for row, total in self._rows(cards, price):
+            full_total += total
+            lines.append('\t'.join(str(value) for value in row))
+            if len(lines) >= CHUNK_SIZE:
+                out.write('\n'.join(lines) + '\n')
+                lines = []
+        if lines:
+            out.write('\n'.join(lines) + '\n')
+        out.flush()
+        return full_total
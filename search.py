@@ -90,17 +90,19 @@ class Query:
         self.syntax = syntax
 
     def _build_string(self, lexum: Lexum):
+        # Values end up inside quoted SQL strings
+        value = lexum.value.replace("'", "''")
         if lexum.op in ['<', '<=']:
-            return Query.operators[lexum.op].format(lexum.value)
-        return Query.operators[lexum.op].format(Query.text_codes_sql[lexum.cmd], lexum.value)
+            return Query.operators[lexum.op].format(value)
+        return Query.operators[lexum.op].format(Query.text_codes_sql[lexum.cmd], value)
 
     def generate_query(self, user_id: int) -> str:
 
         base_query = f"""\
             SELECT c.name, c.rarity, c.type, c.setCode, c.colors,
-            u2c.amount, u2c.card_uuid, c.scryfallId FROM cards c
+            u2c.amount, c.uuid, c.scryfallId FROM cards c
             INNER JOIN user2card as u2c
-            ON u2c.card_uuid == c.uuid
+            ON u2c.card_id == c.id
             WHERE u2c.user_id == {user_id} AND
             u2c.amount > 0 AND
         """
@@ -0,0 +1,211 @@
+"""
+    Local HTTP server so several people can use one MTGA database at once.
+
+    Reads go through a pool of connections, all writes go through a single
+    write queue so concurrent users never hit 'database is locked', and
+    card changes from different requests are committed together.
+
+    python server.py [--host 127.0.0.1] [--port 8080]
+"""
+import argparse
+import json
+import os
+import queue
+import re
+import sqlite3
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict
+from urllib.parse import parse_qs, urlparse
+import CRUD
+import utils
+from card import Card
+from options import Options
+from user import User
+from writer import WriteQueue
+
+
+def connect(filename: Path, readonly: bool = False) -> sqlite3.Connection:
+    """
+        Connection that can be handed between the server threads.
+    """
+    if readonly:
+        db = sqlite3.connect(
+            f'file:{filename}?mode=ro', uri=True, check_same_thread=False
+        )
+    else:
+        db = sqlite3.connect(filename, check_same_thread=False)
+    db.execute('PRAGMA busy_timeout = 5000')
+    return db
+
+
+class ConnectionPool:
+    """
+        Fixed size pool of read only connections.
+    """
+    def __init__(self, filename: Path, size: int = None):
+        self.size = size or os.cpu_count() or 4
+        self.connections = queue.Queue()
+        for _ in range(self.size):
+            self.connections.put(connect(filename, readonly=True))
+
+    @contextmanager
+    def connection(self):
+        db = self.connections.get()
+        try:
+            yield db
+        finally:
+            self.connections.put(db)
+
+    def close(self):
+        for _ in range(self.size):
+            CRUD.close_db_connection(self.connections.get())
+
+
+def card_dict(card: Card) -> Dict:
+    data = {k: v for k, v in card.__dict__.items() if not k.startswith('_')}
+    data['uuid'] = card._uuid
+    data['scryfallId'] = card._scry_id
+    return data
+
+
+MAX_LIMIT = 1000
+SEARCH_TERM = re.compile(r'(?:[ctos]|name)[:=<>]+(?:"[^"]*"|[^=\s])*', re.IGNORECASE)
+
+
+def valid_search(text: str) -> bool:
+    """
+        Only search syntax is allowed in a search, no SQL of any kind.
+    """
+    if re.search(r";|--|/\*|\\", text):
+        return False
+    return not SEARCH_TERM.sub('', text).strip()
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+        GET  /users
+        GET  /search?user=<name>&q=<search terms>
+        GET  /collection?user=<name>&limit=<num>
+        GET  /prices?user=<name>&limit=<num>
+        POST /add     {"user": <name>, "cards": [{"uuid": .., "amount": ..}]}
+        POST /remove  {"user": <name>, "cards": [{"uuid": .., "amount": ..}]}
+    """
+    pool: ConnectionPool = None
+    writer: WriteQueue = None
+
+    def send_json(self, data, status: int = 200):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def get_user(self, db: sqlite3.Connection, name: str) -> User:
+        users = utils.query_users(db)
+        if not isinstance(name, str) or name.lower() not in users:
+            return None
+        return User(name.lower(), users[name.lower()])
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        with self.pool.connection() as db:
+            if url.path == '/users':
+                return self.send_json(list(utils.query_users(db)))
+            user = self.get_user(db, params.get('user'))
+            if not user:
+                return self.send_json({'error': 'Unknown user.'}, 404)
+            try:
+                limit = int(params.get('limit', 10))
+            except ValueError:
+                limit = 0
+            if not 0 < limit <= MAX_LIMIT:
+                return self.send_json(
+                    {'error': f'limit must be 1 to {MAX_LIMIT}.'}, 400
+                )
+            if url.path == '/search':
+                if not valid_search(params.get('q', '')):
+                    return self.send_json({'error': 'Bad search.'}, 400)
+                cards = utils.search(db, user, params.get('q', ''))[:limit]
+            elif url.path == '/collection':
+                cards = utils.query_collection(db, user, limit=limit)
+            elif url.path == '/prices':
+                cards = utils.query_collection_prices(db, user, limit=limit)
+            else:
+                return self.send_json({'error': 'Not found.'}, 404)
+        self.send_json([card_dict(card) for card in cards])
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            data = json.loads(self.rfile.read(length))
+            cards = [
+                Card('', int(card['amount']), uuid=str(card['uuid']))
+                for card in data['cards']
+            ]
+        except (ValueError, KeyError, TypeError):
+            return self.send_json({'error': 'Bad request.'}, 400)
+        if not isinstance(data.get('user'), str):
+            return self.send_json({'error': 'user must be a name.'}, 400)
+        if any(card.amount <= 0 for card in cards):
+            return self.send_json({'error': 'amount must be positive.'}, 400)
+        with self.pool.connection() as db:
+            user = self.get_user(db, data.get('user'))
+        if not user:
+            return self.send_json({'error': 'Unknown user.'}, 404)
+
+        if url.path == '/add':
+            sign = 1
+        elif url.path == '/remove':
+            sign = -1
+        else:
+            return self.send_json({'error': 'Not found.'}, 404)
+        batch = None
+        for card in cards:
+            batch = self.writer.add(user.id, card._uuid, sign * card.amount)
+        # Answer once the group commit holding these changes is durable
+        if batch:
+            try:
+                batch.result()
+            except Exception as e:
+                return self.send_json({'error': f'Write failed: {e}'}, 500)
+        self.send_json({'updated': len(cards)})
+
+
+class Server(ThreadingHTTPServer):
+    # Room for bursts of clients connecting at once
+    request_queue_size = 128
+    daemon_threads = True
+
+
+def serve(options: Options, host: str, port: int, readers: int = None):
+    CRUD.close_db_connection(utils.database_init(options))
+    filename = options.database
+    writer = WriteQueue(filename)
+    writer.start()
+    pool = ConnectionPool(filename, readers)
+    Handler.pool = pool
+    Handler.writer = writer
+    server = Server((host, port), Handler)
+    print(f'Serving {filename} on http://{host}:{port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.close()
+        writer.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='MTGA local server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--readers', type=int, default=None)
+    args = parser.parse_args()
+    serve(Options(utils.WORKING_DIR), args.host, args.port, args.readers)
@@ -0,0 +1,104 @@
+"""
+    Collection analytics for MTGA
+
+    The collection is loaded into NumPy arrays with one query and every
+    report is computed over whole columns at once.
+"""
+import sqlite3
+from typing import Dict, List, Tuple
+import numpy as np
+import CRUD
+from user import User
+
+COLOR_BITS = {
+    'W': 1,
+    'U': 2,
+    'B': 4,
+    'R': 8,
+    'G': 16,
+}
+PERCENTILES = [50, 75, 90, 95, 99]
+CURVE_MAX = 7
+
+
+def load_collection(db: sqlite3.Connection, user: User) -> Dict[str, np.ndarray]:
+    """
+        User's collection as one array per column.
+    """
+    rows = CRUD.get_collection_columns(db, user)
+    amount, price, rarity, color, mana, sets, land = (
+        zip(*rows) if rows else ([],) * 7
+    )
+    return {
+        'amount': np.array(amount, dtype=np.int64),
+        'price': np.array(price, dtype=np.int64),
+        'rarity': np.array(rarity, dtype=str),
+        'color': np.array(color, dtype=np.int64),
+        'mana': np.array(mana, dtype=np.float64),
+        'set': np.array(sets, dtype=str),
+        'land': np.array(land, dtype=bool),
+    }
+
+
+def value_by(cards: Dict[str, np.ndarray], column: str) -> List[Tuple]:
+    """
+        (group, copies, value in cents) for each value of a column,
+        most valuable first.
+    """
+    if not len(cards['amount']):
+        return []
+    groups, inverse = np.unique(cards[column], return_inverse=True)
+    copies = np.bincount(inverse, weights=cards['amount'])
+    value = np.bincount(inverse, weights=cards['amount'] * cards['price'])
+    order = np.argsort(-value, kind='stable')
+    return [
+        (groups[i], int(copies[i]), int(value[i]))
+        for i in order
+    ]
+
+
+def value_by_color(cards: Dict[str, np.ndarray]) -> List[Tuple]:
+    """
+        (color, copies, value in cents). Multicolored cards count toward
+        each of their colors.
+    """
+    totals = cards['amount'] * cards['price']
+    result = []
+    for name, bit in COLOR_BITS.items():
+        has = (cards['color'] & bit) != 0
+        result.append(
+            (name, int(cards['amount'][has].sum()), int(totals[has].sum()))
+        )
+    colorless = cards['color'] == 0
+    result.append(
+        ('C', int(cards['amount'][colorless].sum()), int(totals[colorless].sum()))
+    )
+    # More than one bit set
+    multi = (cards['color'] & (cards['color'] - 1)) != 0
+    result.append(
+        ('Multi', int(cards['amount'][multi].sum()), int(totals[multi].sum()))
+    )
+    return result
+
+
+def mana_curve(cards: Dict[str, np.ndarray]) -> np.ndarray:
+    """
+        Copies of non land cards at each mana value, the last bucket is
+        CURVE_MAX and above.
+    """
+    spells = ~cards['land']
+    buckets = np.minimum(cards['mana'][spells], CURVE_MAX).astype(np.int64)
+    return np.bincount(
+        buckets, weights=cards['amount'][spells], minlength=CURVE_MAX + 1
+    ).astype(np.int64)
+
+
+def price_percentiles(cards: Dict[str, np.ndarray]) -> List[Tuple]:
+    """
+        (percentile, price in cents) over every priced copy.
+    """
+    priced = cards['price'] > 0
+    if not priced.any():
+        return []
+    copies = np.repeat(cards['price'][priced], cards['amount'][priced])
+    return list(zip(PERCENTILES, np.percentile(copies, PERCENTILES)))
@@ -0,0 +1,56 @@
+"""
+    Background task class for MTGA
+"""
+import threading
+from typing import Any, Callable
+
+
+class Task(threading.Thread):
+    """
+        Run a function on a daemon thread and keep its result or error
+        around so the shell can pick it up between commands.
+    """
+    def __init__(
+        self,
+        name: str,
+        target: Callable,
+        *args,
+        progress: bool = False,
+        **kwargs
+    ):
+        super().__init__(name=name, daemon=True)
+        self._func = target
+        self._func_args = args
+        self._func_kwargs = kwargs
+        if progress:
+            self._func_kwargs['progress'] = self.update
+        self.result = None
+        self.error = None
+        self.progress = (0, 0)
+
+    def run(self):
+        try:
+            self.result = self._func(*self._func_args, **self._func_kwargs)
+        except Exception as e:
+            self.error = e
+
+    def update(self, completed: int, total: int) -> None:
+        self.progress = (completed, total)
+
+    @property
+    def percent(self) -> int:
+        completed, total = self.progress
+        if not total:
+            return 0
+        return int(completed * 100 / total)
+
+    def done(self) -> bool:
+        return not self.is_alive()
+
+    def get(self) -> Any:
+        """
+            Return the result of the task or raise its error.
+        """
+        if self.error is not None:
+            raise self.error
+        return self.result
@@ -0,0 +1,50 @@
+"""
+    User data snapshots restored into another catalog.
+"""
+import shutil
+import sqlite3
+import CRUD
+
+
+def make_database(filename, uuids):
+    db = sqlite3.connect(filename)
+    db.execute("""
+    CREATE TABLE cards (
+        id INTEGER PRIMARY KEY, uuid TEXT, name TEXT, rarity TEXT,
+        type TEXT, setCode TEXT, colors TEXT, scryfallId TEXT
+    )
+    """)
+    db.executemany(
+        "INSERT INTO cards (uuid, name) VALUES (?, ?)",
+        ((uuid, uuid) for uuid in uuids)
+    )
+    CRUD.initialize_database(db)
+    with db:
+        db.execute("INSERT INTO user (name) VALUES ('test')")
+    return db
+
+
+def test_restore_keeps_cards_missing_from_catalog(tmp_path):
+    db = make_database(tmp_path / 'mtga.sqlite', ['uuid-1', 'uuid-2'])
+    CRUD.apply_card_deltas(db, [(1, 'uuid-1', 2), (1, 'uuid-2', 1)])
+    with db:
+        db.execute("INSERT INTO unmatched_cards VALUES (1, 'uuid-3', 0, 4)")
+    db.close()
+    snapshot = tmp_path / 'snapshot.sqlite'
+    shutil.copy(tmp_path / 'mtga.sqlite', snapshot)
+    snap = sqlite3.connect(snapshot)
+    CRUD.slim_snapshot(snap)
+    assert CRUD.check_snapshot(snap) == ''
+    snap.close()
+
+    db = make_database(tmp_path / 'other.sqlite', ['uuid-1', 'uuid-3'])
+    with db:
+        db.execute("INSERT INTO unmatched_cards VALUES (1, 'uuid-old', 0, 1)")
+    assert CRUD.restore_user_data(db, snapshot) == (2, 1)
+    assert dict(db.execute("""
+    SELECT c.uuid, x.amount FROM user2card x JOIN cards c ON c.id = x.card_id
+    """)) == {'uuid-1': 2, 'uuid-3': 4}
+    assert db.execute(
+        "SELECT user_id, card_uuid, amount FROM unmatched_cards"
+    ).fetchall() == [(1, 'uuid-2', 1)]
+    db.close()
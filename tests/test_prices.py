@@ -0,0 +1,78 @@
+"""
+    Bulk price ingest from local fixture files.
+"""
+import datetime
+import sqlite3
+from pathlib import Path
+import ijson
+import pytest
+import CRUD
+import utils
+
+FIXTURES = Path(__file__).parent / 'fixtures'
+
+
+@pytest.fixture
+def db():
+    db = sqlite3.connect(':memory:')
+    db.execute("""
+    CREATE TABLE cards (
+        id INTEGER PRIMARY KEY, uuid TEXT, name TEXT, rarity TEXT,
+        type TEXT, setCode TEXT, colors TEXT, scryfallId TEXT
+    )
+    """)
+    db.executemany(
+        "INSERT INTO cards (uuid, name, scryfallId) VALUES (?, ?, ?)",
+        [
+            ('uuid-1', 'One', 'scry-1'),
+            ('uuid-2', 'Two', 'scry-2'),
+            ('uuid-unowned', 'Other', 'scry-unowned'),
+        ]
+    )
+    CRUD.initialize_database(db)
+    with db:
+        db.execute("INSERT INTO user (name) VALUES ('test')")
+        db.execute(
+            "INSERT INTO user2card (user_id, card_id, amount) VALUES (1, 1, 2), (1, 2, 1)"
+        )
+    yield db
+    db.close()
+
+
+def prices(db):
+    return db.execute(
+        "SELECT scryfallId, date, usd, usd_foil FROM price_history ORDER BY 1, 2"
+    ).fetchall()
+
+
+def test_mtgjson_file(db):
+    total = utils.update_prices(db, str(FIXTURES / 'AllPricesToday.json'))
+    assert total == 2
+    assert prices(db) == [
+        ('scry-1', '2026-10-19', 150, 400),
+        ('scry-2', '2026-10-19', None, 1299),
+    ]
+
+
+def test_scryfall_file(db):
+    today = datetime.date.today().isoformat()
+    total = utils.update_prices(db, str(FIXTURES / 'default-cards.json'))
+    assert total == 2
+    assert prices(db) == [
+        ('scry-1', today, 150, 400),
+        ('scry-2', today, None, 1299),
+    ]
+
+
+def test_small_chunks(db):
+    total = utils.update_prices(
+        db, str(FIXTURES / 'AllPricesToday.json'), chunk_size=1
+    )
+    assert total == 2
+
+
+def test_malformed_file(db, tmp_path):
+    broken = tmp_path / 'broken.json'
+    broken.write_text('{"data": {"uuid-1": {"paper": ')
+    with pytest.raises(ijson.JSONError):
+        utils.update_prices(db, str(broken))
@@ -0,0 +1,122 @@
+"""
+    Syncing collections between two databases through export files.
+"""
+import shutil
+import sqlite3
+import pytest
+import CRUD
+import utils
+
+CARDS = [('uuid-1', 'One'), ('uuid-2', 'Two'), ('uuid-3', 'Three')]
+
+
+def make_database(filename, cards=CARDS, owned=()):
+    db = sqlite3.connect(filename)
+    db.execute("""
+    CREATE TABLE cards (
+        id INTEGER PRIMARY KEY, uuid TEXT, name TEXT, rarity TEXT,
+        type TEXT, setCode TEXT, colors TEXT, scryfallId TEXT
+    )
+    """)
+    db.executemany("INSERT INTO cards (uuid, name) VALUES (?, ?)", cards)
+    CRUD.initialize_database(db)
+    with db:
+        db.execute("INSERT INTO user (name) VALUES ('test')")
+    CRUD.apply_card_deltas(db, [(1, uuid, amount) for uuid, amount in owned])
+    # Cards owned from before syncing existed, logged as the baseline
+    with db:
+        db.execute("DELETE FROM change_log")
+    CRUD.initialize_sync(db)
+    return db
+
+
+def amounts(db):
+    return dict(db.execute("""
+    SELECT c.uuid, x.amount FROM user2card x
+    JOIN cards c ON c.id = x.card_id
+    WHERE x.amount > 0
+    """))
+
+
+def sync(source, target, filename, shared_baseline=False):
+    utils.sync_export(source, filename)
+    return utils.sync_import(target, filename, shared_baseline)
+
+
+@pytest.fixture
+def first(tmp_path):
+    db = make_database(tmp_path / 'first.sqlite')
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def second(tmp_path):
+    db = make_database(tmp_path / 'second.sqlite')
+    yield db
+    db.close()
+
+
+def test_export_import(first, second, tmp_path):
+    CRUD.apply_card_deltas(first, [(1, 'uuid-1', 2), (1, 'uuid-2', 1)])
+    CRUD.apply_card_deltas(first, [(1, 'uuid-2', -1)])
+    assert sync(first, second, tmp_path / 'changes.json.gz') == 3
+    assert amounts(second) == {'uuid-1': 2}
+    # Applied changes are logged, not logged again under the second node
+    assert CRUD.get_changes_for(second, CRUD.get_node(first)) == []
+
+
+def test_reimport_is_noop(first, second, tmp_path):
+    filename = tmp_path / 'changes.json.gz'
+    CRUD.apply_card_deltas(first, [(1, 'uuid-1', 2)])
+    assert sync(first, second, filename) == 1
+    assert utils.sync_import(second, filename) == 0
+    assert amounts(second) == {'uuid-1': 2}
+
+
+def test_missing_cards_held_until_catalog_has_them(tmp_path):
+    first = make_database(tmp_path / 'first.sqlite')
+    second = make_database(tmp_path / 'second.sqlite', cards=CARDS[:2])
+    CRUD.apply_card_deltas(first, [(1, 'uuid-1', 1), (1, 'uuid-3', 4)])
+    assert sync(first, second, tmp_path / 'changes.json.gz') == 1
+    assert CRUD.count_held_changes(second) == 1
+    assert amounts(second) == {'uuid-1': 1}
+
+    with second:
+        second.execute("INSERT INTO cards (uuid, name) VALUES ('uuid-3', 'Three')")
+    # What an update does once the new catalog is in place
+    assert CRUD.apply_changes(second, '', [], []) == 1
+    assert CRUD.count_held_changes(second) == 0
+    assert amounts(second) == {'uuid-1': 1, 'uuid-3': 4}
+    first.close()
+    second.close()
+
+
+def test_clone_refused_until_reid(first, tmp_path):
+    CRUD.apply_card_deltas(first, [(1, 'uuid-1', 2)])
+    first.commit()
+    shutil.copy(tmp_path / 'first.sqlite', tmp_path / 'clone.sqlite')
+    clone = sqlite3.connect(tmp_path / 'clone.sqlite')
+    CRUD.apply_card_deltas(first, [(1, 'uuid-2', 1)])
+    filename = tmp_path / 'changes.json.gz'
+    with pytest.raises(ValueError, match='sync reid'):
+        sync(first, clone, filename)
+
+    CRUD.reid_node(clone)
+    # Only the change made after copying is new to the clone
+    assert utils.sync_import(clone, filename) == 1
+    assert amounts(clone) == {'uuid-1': 2, 'uuid-2': 1}
+    clone.close()
+
+
+def test_shared_baseline_not_doubled(tmp_path):
+    # Two copies of one collection that each changed before their first sync
+    first = make_database(tmp_path / 'first.sqlite', owned=[('uuid-1', 2)])
+    second = make_database(
+        tmp_path / 'second.sqlite', owned=[('uuid-1', 2), ('uuid-2', 1)]
+    )
+    CRUD.apply_card_deltas(first, [(1, 'uuid-3', 1)])
+    sync(first, second, tmp_path / 'changes.json.gz', shared_baseline=True)
+    assert amounts(second) == {'uuid-1': 2, 'uuid-2': 1, 'uuid-3': 1}
+    first.close()
+    second.close()
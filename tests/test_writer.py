@@ -0,0 +1,95 @@
+"""
+    Group commit of the write behind queue.
+"""
+import sqlite3
+import time
+import pytest
+import CRUD
+from user import User
+from writer import WriteQueue
+
+
+@pytest.fixture
+def database(tmp_path):
+    filename = tmp_path / 'mtga.sqlite'
+    db = sqlite3.connect(filename)
+    db.execute("""
+    CREATE TABLE cards (
+        id INTEGER PRIMARY KEY, uuid TEXT, name TEXT, rarity TEXT,
+        type TEXT, setCode TEXT, colors TEXT, scryfallId TEXT
+    )
+    """)
+    db.executemany(
+        "INSERT INTO cards (uuid, name) VALUES (?, ?)",
+        [('uuid-1', 'One'), ('uuid-2', 'Two')]
+    )
+    CRUD.initialize_database(db)
+    with db:
+        db.execute("INSERT INTO user (name) VALUES ('test')")
+        db.execute(
+            "INSERT INTO user2card (user_id, card_id, amount) VALUES (1, 1, 2)"
+        )
+    db.close()
+    return filename
+
+
+@pytest.fixture
+def writer(database):
+    # A long window so everything a test queues lands in one batch
+    writer = WriteQueue(database, window=5)
+    writer.start()
+    yield writer
+    writer.close()
+
+
+def amounts(filename):
+    db = sqlite3.connect(filename)
+    rows = dict(db.execute("""
+    SELECT c.uuid, uc.amount FROM user2card uc
+    JOIN cards c ON c.id = uc.card_id
+    """))
+    db.close()
+    return rows
+
+
+def test_opposing_deltas_cancel(database, writer, monkeypatch):
+    applied = []
+    apply_card_deltas = CRUD.apply_card_deltas
+    monkeypatch.setattr(
+        CRUD, 'apply_card_deltas',
+        lambda db, deltas: applied.append(deltas) or apply_card_deltas(db, deltas)
+    )
+    writer.add(1, 'uuid-1', 3)
+    writer.add(1, 'uuid-1', -3)
+    writer.add(1, 'uuid-2', 1)
+    writer.flush()
+    assert applied == [[(1, 'uuid-2', 1)]]
+    assert amounts(database) == {'uuid-1': 2, 'uuid-2': 1}
+
+
+def test_batch_commits_once(database, writer, monkeypatch):
+    commits = []
+    apply_card_deltas = CRUD.apply_card_deltas
+    monkeypatch.setattr(
+        CRUD, 'apply_card_deltas',
+        lambda db, deltas: commits.append(deltas) or apply_card_deltas(db, deltas)
+    )
+    futures = {writer.add(1, 'uuid-2', 1) for _ in range(50)}
+    writer.flush()
+    assert len(futures) == 1
+    assert len(commits) == 1
+    assert amounts(database)['uuid-2'] == 50
+
+
+def test_flush_waits_until_durable(database, writer):
+    writer.add(1, 'uuid-1', -1)
+    job = writer.submit(CRUD.add_user, User('other'))
+    start = time.monotonic()
+    writer.flush()
+    # Flushing commits now rather than at the end of the window
+    assert time.monotonic() - start < writer.window
+    assert job.done()
+    assert amounts(database) == {'uuid-1': 1}
+    db = sqlite3.connect(database)
+    assert db.execute("SELECT name FROM user WHERE name = 'other'").fetchone()
+    db.close()
@@ -6,15 +6,23 @@ import json
 import urllib3
 import datetime
 import os
+import itertools
+import functools
+import gzip
+import shutil
+import tempfile
+import ijson
+from ast import literal_eval
 from card import Card
 from options import Options
 from user import User
 from typing import List
 from typing import Dict
+from typing import Callable
+from typing import Generator
+from typing import Tuple
 from rich import print
-from rich.pretty import pprint
 from rich.text import Text
-from rich.progress import Progress
 from pathlib import Path
 from search import Syntax, Query
 
@@ -36,7 +44,7 @@ def sql2cards(cards: List) -> List[Card]:
         sqlite output:
         c.name, c.rarity, c.type, c.setCode,
             0      1        2         3
-        c.color, x.amount, x.card_uuidd, c.scryfallId
+        c.color, x.amount, c.uuid, c.scryfallId
             4         5          6            7
     """
     return [
@@ -50,14 +58,23 @@ def sql2cards(cards: List) -> List[Card]:
     ]
 
 
-def get_color(card: Card) -> Text:
+@functools.lru_cache(maxsize=64)
+def color_text(color: str) -> Text:
+    """
+        Colored names for a color string like 'B,R'. Cached, so don't
+        modify the returned Text.
+    """
     tmp = Text()
-    for color in card.color.split(','):
+    for color in color.split(','):
         color_tuple = colors.get(color, ('Colorless', 'bright_black'))
         tmp += Text(*color_tuple)
     return tmp
 
 
+def get_color(card: Card) -> Text:
+    return color_text(card.color or 'C')
+
+
 def search(db: sqlite3.Connection, user: User, search: str, clip: bool = False) -> List[Card]:
     if not clip:
         s = Syntax(search)
@@ -88,48 +105,233 @@ def generate_api_query(cards: List[Card]) -> Dict:
     return data
 
 
-def get_prices(cards: List[Card]):
+def fetch_prices(scry_ids: List[str]) -> tuple:
+    """
+        Get (usd, usd_foil) for up to 75 scryfallIds from scryfall.
+        Returns the prices by id and the identifiers that were not found.
+    """
+    data = json.dumps({"identifiers": [{"id": i} for i in scry_ids]})
+    url = 'https://api.scryfall.com/cards/collection'
+    headers = {"Content-Type": "application/json"}
+    http = urllib3.PoolManager()
+    try:
+        response = http.request(
+            "POST",
+            url,
+            headers=headers,
+            body=data
+        )
+    except urllib3.exceptions.MaxRetryError:
+        raise ConnectionError('Unable to Connect to MTGJSON.')
+    if response.status != 200:
+        raise ValueError(response.data.decode(errors='replace'))
+    data = json.loads(response.data)
+    prices = {}
+    for item in data['data']:
+        usd = item['prices'].get('usd')
+        usd_foil = item['prices'].get('usd_foil')
+        prices[item['id']] = (
+            float(usd) if usd is not None else None,
+            float(usd_foil) if usd_foil is not None else None,
+        )
+    return prices, data['not_found']
+
+
+def get_prices(cards: List[Card], cache=None):
     """
-        Get prices from scryfall
+        Get prices from scryfall, using the prefetch cache where it can
     """
+    prices = {}
+    missing = []
+    for card in cards:
+        price = cache.get(card._scry_id) if cache else None
+        if price is not None:
+            prices[card._scry_id] = price
+        elif card._scry_id and card._scry_id not in missing:
+            missing.append(card._scry_id)
+
     chunk_size = 75
     chunk = 0
-    while chunk < len(cards):
+    while chunk < len(missing):
         offset = chunk + chunk_size
-        data = generate_api_query(cards[chunk:offset])
-        data = json.dumps(data)
-        url = 'https://api.scryfall.com/cards/collection'
-        headers = {"Content-Type": "application/json"}
-        breakpoint()
-        http = urllib3.PoolManager()
         try:
-            response = http.request(
-                "POST",
-                url,
-                headers=headers,
-                body=data
-            )
-        except urllib3.exceptions.MaxRetryError:
-            raise ConnectionError('Unable to Connect to MTGJSON.')
-        if response.status != 200:
+            fetched, not_found = fetch_prices(missing[chunk:offset])
+        except ValueError as e:
             print("Bad request!!!")
-            print(response.text)
+            print(e)
             return
-        data = json.loads(response.data)
-        if data['not_found']:
-            print(f"Unable to locate: {data['not_found']}")
-            pprint(data)
-        for item in data['data']:
-            for card in cards:
-                if card._scry_id == item['id']:
-                    if item['prices']['usd'] is not None:
-                        card.price = float(item['prices'].get('usd'))
-                    if item['prices']['usd_foil'] is not None:
-                        card.foil_price = float(item['prices'].get('usd_foil'))
-
-                    break
+        if not_found:
+            print(f"Unable to locate: {not_found}")
+        for scry_id, price in fetched.items():
+            if cache:
+                cache.put(scry_id, price)
+            prices[scry_id] = price
         chunk += chunk_size
 
+    for card in cards:
+        usd, usd_foil = prices.get(card._scry_id, (None, None))
+        if usd is not None:
+            card.price = usd
+        if usd_foil is not None:
+            card.foil_price = usd_foil
+
+
+def to_cents(price) -> int:
+    return round(float(price) * 100) if price else None
+
+
+def record_prices(db: sqlite3.Connection, cards: List[Card]) -> int:
+    """
+        Save today's prices of the cards to the price history.
+    """
+    today = datetime.date.today().isoformat()
+    prices = {
+        card._scry_id: (
+            card._scry_id, today,
+            to_cents(card.price), to_cents(card.foil_price)
+        )
+        for card in cards
+        if card._scry_id and (card.price or card.foil_price)
+    }
+    count = CRUD.add_price_history(db, list(prices.values()))
+    CRUD.revalue_summary(db, list(prices))
+    return count
+
+
+def mtgjson_prices(events, owned: Dict[str, str]) -> Generator:
+    """
+        Stream (scryfallId, date, usd, usd_foil) out of an MTGJSON
+        AllPricesToday event stream for the uuids in owned.
+    """
+    for uuid, formats in ijson.kvitems(events, 'data'):
+        scry_id = owned.get(uuid)
+        if not scry_id:
+            continue
+        retail = formats.get('paper', {}).get('tcgplayer', {}).get('retail', {})
+        normal = retail.get('normal', {})
+        foil = retail.get('foil', {})
+        dates = sorted(set(normal) | set(foil))
+        if not dates:
+            continue
+        date = dates[-1]
+        yield (
+            scry_id, date,
+            to_cents(normal.get(date)), to_cents(foil.get(date))
+        )
+
+
+def scryfall_prices(events, owned: Dict[str, str]) -> Generator:
+    """
+        Stream (scryfallId, date, usd, usd_foil) out of a Scryfall bulk
+        card event stream for the scryfallIds in owned.
+    """
+    scry_ids = set(owned.values())
+    today = datetime.date.today().isoformat()
+    for item in ijson.items(events, 'item'):
+        if item.get('id') not in scry_ids:
+            continue
+        prices = item.get('prices', {})
+        yield (
+            item['id'], today,
+            to_cents(prices.get('usd')), to_cents(prices.get('usd_foil'))
+        )
+
+
+def open_price_source(source: str):
+    """
+        Open a local price file or stream one of the known bulk downloads.
+    """
+    urls = {
+        'mtgjson': 'https://mtgjson.com/api/v5/AllPricesToday.json',
+        'scryfall': 'https://api.scryfall.com/bulk-data/default-cards',
+    }
+    if source not in urls:
+        return open(source, 'rb')
+
+    http = urllib3.PoolManager()
+    try:
+        url = urls[source]
+        if source == 'scryfall':
+            resp = http.request("GET", url)
+            url = json.loads(resp.data)['download_uri']
+        resp = http.request("GET", url, preload_content=False)
+    except urllib3.exceptions.MaxRetryError:
+        raise ConnectionError(f'Unable to Connect to {source}.')
+    if resp.status != 200:
+        raise ConnectionError(f'Error: {resp.status}')
+    return resp
+
+
+def update_prices(
+    db: sqlite3.Connection,
+    source: str = 'mtgjson',
+    chunk_size: int = 1000,
+) -> int:
+    """
+        Load prices for every owned card from a bulk price file without
+        reading the whole file into memory.
+        source is 'mtgjson', 'scryfall' or a path to a local file in
+        either format.
+    """
+    owned = dict(CRUD.get_owned_ids(db))
+    if not owned:
+        return 0
+
+    fh = open_price_source(source)
+    try:
+        # MTGJSON is an object with a data key, Scryfall is a list of cards
+        events = ijson.parse(fh)
+        first = next(events)
+        events = itertools.chain([first], events)
+        if first[1] == 'start_array':
+            prices = scryfall_prices(events, owned)
+        else:
+            prices = mtgjson_prices(events, owned)
+
+        total = 0
+        while chunk := list(itertools.islice(prices, chunk_size)):
+            total += CRUD.add_price_history(db, chunk)
+    finally:
+        fh.close()
+
+    if total:
+        CRUD.rebuild_summary(db)
+
+    return total
+
+
+def since_date(days: int) -> str:
+    return (datetime.date.today() - datetime.timedelta(days=days)).isoformat()
+
+
+def collection_value(db: sqlite3.Connection, user: User, days: int = 30) -> List:
+    return CRUD.get_collection_value(db, user, since_date(days))
+
+
+def price_movers(
+    db: sqlite3.Connection,
+    user: User,
+    days: int = 7,
+    limit: int = 10,
+) -> List:
+    return CRUD.get_price_movers(db, user, since_date(days), limit)
+
+
+def parse_kwargs(args: str) -> Dict:
+    """
+        Turn 'key=value key=value' shell arguments into a dict.
+    """
+    try:
+        return dict(
+            (k, literal_eval(v))
+            for k, v in (
+                pair.split('=')
+                for pair in args.split()
+            )
+        )
+    except Exception:
+        return {}
+
 
 def query_collection(db: sqlite3.Connection, user: User, **kwargs):
     limit = kwargs.get('limit', 10)
@@ -137,6 +339,28 @@ def query_collection(db: sqlite3.Connection, user: User, **kwargs):
     return sql2cards(cards)
 
 
+def iter_collection(db: sqlite3.Connection, user: User, **kwargs) -> Generator:
+    """
+        User's collection as cards, read from the database in chunks.
+    """
+    limit = kwargs.get('limit', 10)
+    for rows in CRUD.iter_cards_user(db, user, limit):
+        yield from sql2cards(rows)
+
+
+def query_collection_prices(db: sqlite3.Connection, user: User, **kwargs):
+    """
+        User's collection priced from the local price history.
+    """
+    limit = kwargs.get('limit', 10)
+    rows = CRUD.get_cards_user_prices(db, user, limit)
+    cards = sql2cards(rows)
+    for card, row in zip(cards, rows):
+        card.price = (row[8] or 0) / 100
+        card.foil_price = (row[9] or 0) / 100
+    return cards
+
+
 def query_users(db: sqlite3.Connection) -> Dict[str, int]:
     users = CRUD.get_users(db)
     return dict((user[1], user[0]) for user in users)
@@ -144,7 +368,12 @@ def query_users(db: sqlite3.Connection) -> Dict[str, int]:
 
 def database_init(options: Options) -> sqlite3.Connection:
     conn = CRUD.connect_with_database(options.database)
+    if CRUD.needs_migration(conn):
+        conn = migrate_database(conn, options.database)
     CRUD.initialize_database(conn)
+    CRUD.initialize_catalog(conn)
+    CRUD.initialize_sync(conn)
+    CRUD.initialize_summary(conn)
     return conn
 
 
@@ -190,6 +419,122 @@ def normalize_text(filename):
     return cards
 
 
+def parse_decklist(text: str) -> Dict[str, int]:
+    """
+        Turn a decklist into {card name: amount}.
+        Accepts '2 Card name' lines with an optional '(SET) 123' at the end,
+        as exported by Arena and most deck builders.
+    """
+    deck = {}
+    for match in re.finditer(r'^\s*([0-9]+)x?\s+(.+?)\s*$', text, re.MULTILINE):
+        name = re.sub(r'\s+\([A-Za-z0-9]+\)(\s+\S+)?$', '', match.group(2))
+        deck[name] = deck.get(name, 0) + int(match.group(1))
+    return deck
+
+
+def deck_diff(db: sqlite3.Connection, user: User, deck: Dict[str, int]) -> List:
+    """
+        Owned, short and missing cards of a decklist across all printings.
+    """
+    return CRUD.get_deck_diff(db, user, list(deck.items()))
+
+
+SUMMARY_COLUMNS = {'set': 'setCode', 'color': 'colors', 'rarity': 'rarity'}
+
+
+def collection_summary(db: sqlite3.Connection, user: User, by: str = 'set') -> List:
+    """
+        Collection totals grouped by set, color or rarity, read from the
+        summary table instead of the whole collection.
+    """
+    return CRUD.get_summary(db, user, SUMMARY_COLUMNS[by])
+
+
+def mark_trade(
+    db: sqlite3.Connection,
+    user: User,
+    cards: List[Card],
+    trade: bool = True,
+) -> int:
+    return CRUD.set_trade(db, user, cards, trade)
+
+
+def trade_cards(db: sqlite3.Connection, user: User) -> List[Card]:
+    return sql2cards(CRUD.get_trade_cards(db, user))
+
+
+def trade_wants(db: sqlite3.Connection, user: User, deck: Dict[str, int]) -> Dict[str, List]:
+    """
+        Other users' tradeable copies of a want list grouped by user, the
+        users offering the most value first.
+    """
+    offers = {}
+    for row in CRUD.get_trade_wants(db, user, list(deck.items())):
+        offers.setdefault(row[0], []).append(row[1:])
+    return dict(sorted(
+        offers.items(),
+        key=lambda item: sum(
+            min(amount, wanted) * (price or 0)
+            for _, _, amount, wanted, price in item[1]
+        ),
+        reverse=True,
+    ))
+
+
+def trade_offers(db: sqlite3.Connection, giver: User, taker: User) -> List:
+    return CRUD.get_trade_offers(db, giver, taker)
+
+
+def trade_balances(db: sqlite3.Connection, user: User) -> List:
+    return CRUD.get_trade_balances(db, user)
+
+
+def sync_export(db: sqlite3.Connection, filename: Path, peer: str = '') -> int:
+    """
+        Write the changes peer has not seen to a gzipped JSON file.
+        Without a peer every change is written.
+    """
+    changes = CRUD.get_changes_for(db, peer)
+    data = {
+        'node': CRUD.get_node(db),
+        'clock': CRUD.get_clock(db),
+        'changes': changes,
+    }
+    with gzip.open(filename, 'wt') as fh:
+        json.dump(data, fh, separators=(',', ':'))
+    return len(changes)
+
+
+def sync_import(
+    db: sqlite3.Connection,
+    filename: Path,
+    shared_baseline: bool = False
+) -> int:
+    """
+        Merge changes from another node's export file.
+    """
+    with gzip.open(filename, 'rt') as fh:
+        data = json.load(fh)
+    if data['node'] == CRUD.get_node(db):
+        raise ValueError(
+            "File was exported from this database, or this database is a "
+            "copy of the one that exported it. Run 'sync reid' on the copy."
+        )
+    return CRUD.apply_changes(
+        db, data['node'], data['clock'], data['changes'], shared_baseline
+    )
+
+
+def find_peer(db: sqlite3.Connection, prefix: str) -> str:
+    """
+        Full name of the known peer starting with prefix.
+    """
+    peers = [peer for peer, _ in CRUD.get_peers(db) if peer.startswith(prefix)]
+    if len(peers) != 1:
+        raise ValueError(f"No single peer matching '{prefix}'.")
+    return peers[0]
+
+
 def get_card_uuid(db: sqlite3.Connection, card: Card) -> None:
     output = CRUD.get_card_uuid(db, card)
     try:
@@ -198,6 +543,31 @@ def get_card_uuid(db: sqlite3.Connection, card: Card) -> None:
         card._uuid = None
 
 
+def merge_import(db: sqlite3.Connection, cards: List[Card]) -> tuple:
+    """
+        Add up imported rows per card before anything is written. Scans
+        list the same card once per copy, foil or condition, and each
+        product id is only looked up once.
+        Returns {uuid: [name, set, rows, amount]} and the cards that
+        could not be found.
+    """
+    uuids = {}
+    merged = {}
+    bad_uuid = []
+    for card in cards:
+        if card._tcg_id not in uuids:
+            get_card_uuid(db, card)
+            uuids[card._tcg_id] = card._uuid
+        card._uuid = uuids[card._tcg_id]
+        if not card._uuid:
+            bad_uuid.append(card)
+            continue
+        entry = merged.setdefault(card._uuid, [card.name, card.set, 0, 0])
+        entry[2] += 1
+        entry[3] += card.amount
+    return merged, bad_uuid
+
+
 def update_collection(
     db: sqlite3.Connection,
     user: User,
@@ -206,18 +576,12 @@ def update_collection(
     """
         Update the database with cards.
     """
-    bad_uuid = []
-    # Get the uuids and clean list
-    for card in cards[:]:
-        get_card_uuid(db, card)
-        if not card._uuid:
-            cards.remove(card)
-            bad_uuid.append(card)
+    merged, bad_uuid = merge_import(db, cards)
 
-    # Add the cards to the database
+    # One upsert per distinct card
     cards_to_db = [
-        (user.id, card._uuid, card.amount, card.amount)
-        for card in cards
+        (user.id, uuid, amount)
+        for uuid, (_, _, _, amount) in merged.items()
     ]
     print(f'Loaded {CRUD.update_collection(db, cards_to_db)} cards.')
 
@@ -242,7 +606,11 @@ def normalize_csv(filename):
     return cards
 
 
-def download_update() -> Path:
+def download_update(progress: Callable[[int, int], None] = None) -> Path:
+    """
+        Download the newest AllPrintings database into the Data directory.
+        progress is called with (completed, total) bytes as chunks arrive.
+    """
     url = 'https://mtgjson.com/api/v5/AllPrintings.sqlite'
 
     http = urllib3.PoolManager()
@@ -258,20 +626,188 @@ def download_update() -> Path:
     if resp.status != 200:
         raise ConnectionError(f'Error: {resp.status}')
     filename = WORKING_DIR / Path('Data') / Path('temp.sqlite')
-    size = int(resp.headers['Content-Length'])
-    with Progress() as progress:
-        task = progress.add_task('Downloading database...', total=size)
-        file = open(filename, 'wb')
+    size = int(resp.headers.get('Content-Length', 0))
+    completed = 0
+    with open(filename, 'wb') as file:
         for chunk in resp.stream(8092):
             file.write(chunk)
-            progress.update(task, advance=8092)
+            completed += len(chunk)
+            if progress:
+                progress(completed, size)
+
+    resp.release_conn()
+    return filename
+
+
+def make_catalog(source: Path) -> Path:
+    """
+        Build a slim catalog database next to source out of its cards.
+    """
+    filename = source.with_name('catalog.sqlite')
+    if filename.exists():
+        filename.unlink()
+    db = CRUD.connect_with_database(filename)
+    CRUD.build_catalog(db, source)
+    with db:
+        db.execute("ANALYZE")
+    CRUD.close_db_connection(db)
+    return filename
 
-        resp.release_conn()
-        file.close()
 
+def build_catalog(full_filename: Path, keep_full: Path = None) -> Path:
+    """
+        Build a slim catalog database out of a downloaded AllPrintings file.
+        The full file is moved to keep_full if given, else deleted.
+    """
+    filename = make_catalog(full_filename)
+    if keep_full:
+        os.replace(full_filename, keep_full)
+    else:
+        full_filename.unlink()
     return filename
 
 
+def prepare_update(
+    keep_full: Path = None,
+    progress: Callable[[int, int], None] = None
+) -> Path:
+    """
+        Download AllPrintings and build the slim catalog from it.
+    """
+    return build_catalog(download_update(progress), keep_full)
+
+
+def discard_update(directory: Path) -> None:
+    """
+        Remove what a failed update left behind in directory.
+    """
+    for name in ('temp.sqlite', 'catalog.sqlite'):
+        Path(directory, name).unlink(missing_ok=True)
+
+
+def migrate_database(db: sqlite3.Connection, filename: Path) -> sqlite3.Connection:
+    """
+        Move a database that stores card uuids in user2card over to card
+        ids. The catalog is rebuilt from the database's own cards table
+        and the old file is kept as a backup.
+    """
+    if not CRUD.get_columns(db, 'cards'):
+        # No catalog downloaded yet so there can't be any cards to keep
+        with db:
+            db.execute("DROP TABLE user2card")
+        return db
+    print('[yellow]Migrating database to card ids...[/]')
+    return update_database(db, filename, make_catalog(filename))
+
+
+def prune_backups(directory: Path, keep: int, pattern: str = 'backup*.sqlite') -> int:
+    """
+        Delete all but the newest keep backups and return the bytes freed.
+    """
+    backups = sorted(
+        directory.glob(pattern),
+        key=lambda path: path.stat().st_mtime,
+        reverse=True,
+    )
+    freed = 0
+    for backup in backups[keep:]:
+        freed += backup.stat().st_size
+        backup.unlink()
+    return freed
+
+
+def maintain(db: sqlite3.Connection, options: Options) -> Dict:
+    """
+        Delete empty collection rows, prune old backups and compact the
+        database. Returns what was done.
+    """
+    before = CRUD.get_database_size(db)
+    deleted = CRUD.delete_empty_cards(db)
+    backups = prune_backups(options.database.parent, options.backups_kept)
+    backups += prune_backups(
+        options.database.parent, options.user_backups_kept,
+        'userdata-*.sqlite.gz'
+    )
+    switched = CRUD.optimize_database(db)
+    return {
+        'rows': deleted,
+        # Switching to incremental vacuum adds pages, so the file can grow
+        'database': max(before - CRUD.get_database_size(db), 0),
+        'backups': backups,
+        'switched': switched,
+    }
+
+
+def temp_file(directory: Path, suffix: str = '.sqlite') -> Path:
+    fd, name = tempfile.mkstemp(suffix=suffix, dir=directory)
+    os.close(fd)
+    return Path(name)
+
+
+def backup_user_data(
+    filename: Path,
+    pages: int = 256,
+    progress: Callable[[int, int], None] = None
+) -> Path:
+    """
+        Snapshot the users and their cards into a small gzipped database
+        next to filename. Meant to run on its own thread with its own
+        connections while the shell keeps going.
+    """
+    temp = temp_file(filename.parent)
+    try:
+        source = sqlite3.connect(filename)
+        target = sqlite3.connect(temp)
+        # The live file is copied a few pages at a time and only locked
+        # while a step runs, so the shell can keep writing in between
+        source.backup(
+            target, pages=pages, sleep=0.05,
+            progress=lambda _, remaining, total: progress and progress(
+                total - remaining, total
+            ),
+        )
+        CRUD.close_db_connection(source)
+        CRUD.slim_snapshot(target)
+        CRUD.close_db_connection(target)
+
+        now = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+        backup = filename.with_name(f'userdata-{now}.sqlite.gz')
+        with open(temp, 'rb') as src, gzip.open(backup, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+    finally:
+        temp.unlink(missing_ok=True)
+    return backup
+
+
+def restore_user_data(db: sqlite3.Connection, backup: Path) -> Tuple[int, int]:
+    """
+        Check a user data backup and restore it into db. Returns the number
+        of cards restored and the number not in the catalog yet.
+    """
+    temp = temp_file(backup.parent)
+    try:
+        with gzip.open(backup, 'rb') as src, open(temp, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        snapshot = sqlite3.connect(temp)
+        try:
+            error = CRUD.check_snapshot(snapshot)
+        except sqlite3.DatabaseError as e:
+            error = str(e)
+        CRUD.close_db_connection(snapshot)
+        if error:
+            raise ValueError(f'Backup failed integrity check: {error}')
+        return CRUD.restore_user_data(db, temp)
+    finally:
+        temp.unlink(missing_ok=True)
+
+
+def latest_user_backup(directory: Path) -> Path:
+    backups = sorted(directory.glob('userdata-*.sqlite.gz'))
+    if not backups:
+        raise FileNotFoundError(f'No user data backups in {directory}.')
+    return backups[-1]
+
+
 def update_database(
     db: sqlite3.Connection,
     old_filename: Path,
@@ -283,7 +819,18 @@ def update_database(
     CRUD.close_db_connection(db)
     db = CRUD.connect_with_database(new_filename)
     CRUD.initialize_database(db)
-    CRUD.update_new_database(db, old_filename)
+    CRUD.initialize_catalog(db)
+    unmatched = CRUD.update_new_database(db, old_filename)
+    if unmatched:
+        print(
+            f'[yellow]{unmatched} owned cards are not in the new catalog. '
+            'They are kept and will be added back once a catalog has them.[/]'
+        )
+    CRUD.initialize_sync(db)
+    # Synced changes held back for missing cards may apply now
+    CRUD.apply_changes(db, '', [], [])
+    # Sets and rarities come from the new catalog
+    CRUD.rebuild_summary(db)
     # Backup old database file
     os.rename(
         old_filename,
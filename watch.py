@@ -0,0 +1,64 @@
+"""
+    Incremental decklist watching for MTGA
+"""
+import sqlite3
+from typing import Dict, List, Optional, Tuple
+import utils
+from user import User
+
+
+class DeckWatch:
+    """
+        Running deck diff of a decklist that is being edited. Each line is
+        parsed once and each card name is looked up once, so a poll only
+        costs the lines that are new or changed since the last one.
+    """
+    def __init__(self, db: sqlite3.Connection, user: User):
+        self.db = db
+        self.user = user
+        self.text_hash = None
+        self.lines: Dict[int, Dict[str, int]] = {}
+        self.deck: Dict[str, int] = {}
+        # name -> (owned, known, price)
+        self.cards: Dict[str, Tuple[int, bool, Optional[int]]] = {}
+
+    def update(self, text: str) -> bool:
+        """
+            Take the latest text of the decklist. Returns whether the
+            deck changed.
+        """
+        text_hash = hash(text)
+        if text_hash == self.text_hash:
+            return False
+        self.text_hash = text_hash
+
+        lines = {}
+        deck = {}
+        for line in text.splitlines():
+            line_hash = hash(line)
+            parsed = self.lines.get(line_hash)
+            if parsed is None:
+                parsed = utils.parse_decklist(line)
+            lines[line_hash] = parsed
+            for name, amount in parsed.items():
+                deck[name] = deck.get(name, 0) + amount
+        self.lines = lines
+
+        new = [(name, deck[name]) for name in deck if name not in self.cards]
+        if new:
+            for name, _, owned, known, price in utils.deck_diff(
+                self.db, self.user, dict(new)
+            ):
+                self.cards[name] = (owned, bool(known), price)
+        changed = deck != self.deck
+        self.deck = deck
+        return changed
+
+    def rows(self) -> List:
+        """
+            Same rows as utils.deck_diff for the current deck.
+        """
+        return [
+            (name, wanted, *self.cards.get(name, (0, False, None)))
+            for name, wanted in self.deck.items()
+        ]
@@ -0,0 +1,113 @@
+"""
+    Write behind queue for MTGA
+
+    Card amount changes queued within a short window are merged per
+    (user_id, card_uuid) and written in one transaction (group commit).
+"""
+import threading
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+import sqlite3
+import CRUD
+
+
+class WriteQueue(threading.Thread):
+    def __init__(self, filename: Path, window: float = 0.01):
+        super().__init__(name='write-queue', daemon=True)
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.execute('PRAGMA busy_timeout = 5000')
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.window = window
+        self.lock = threading.Lock()
+        self.pending = threading.Event()
+        self.now = threading.Event()
+        self.closed = False
+        self.deltas: Dict[Tuple[int, str], int] = {}
+        self.jobs: List[Tuple[Future, Callable, Tuple]] = []
+        self.batch = Future()
+        self.inflight = None
+
+    def add(self, user_id: int, card_uuid: str, delta: int) -> Future:
+        """
+            Queue a change of amount for a user's card. Opposing changes to
+            the same card in one batch cancel out. The returned future is
+            done once the batch is committed.
+        """
+        with self.lock:
+            key = (user_id, card_uuid)
+            self.deltas[key] = self.deltas.get(key, 0) + delta
+            self.pending.set()
+            return self.batch
+
+    def submit(self, func: Callable, *args) -> Future:
+        """
+            Queue func(db, *args) to run after the batch's card changes.
+        """
+        future = Future()
+        with self.lock:
+            self.jobs.append((future, func, args))
+            self.pending.set()
+        return future
+
+    def flush(self) -> None:
+        """
+            Commit everything queued so far and wait until it is durable.
+        """
+        with self.lock:
+            if self.deltas or self.jobs:
+                batch = self.batch
+                self.now.set()
+            else:
+                batch = self.inflight
+        if batch:
+            batch.result()
+
+    def run(self):
+        while True:
+            self.pending.wait()
+            self.now.wait(self.window)
+            with self.lock:
+                deltas, self.deltas = self.deltas, {}
+                jobs, self.jobs = self.jobs, []
+                batch, self.batch = self.batch, Future()
+                self.inflight = batch
+                self.pending.clear()
+                self.now.clear()
+                closed = self.closed
+            self.commit(deltas, jobs, batch)
+            if closed:
+                break
+        CRUD.close_db_connection(self.db)
+
+    def commit(self, deltas: Dict, jobs: List, batch: Future) -> None:
+        error = None
+        try:
+            CRUD.apply_card_deltas(self.db, [
+                (user_id, card_uuid, delta)
+                for (user_id, card_uuid), delta in deltas.items()
+                if delta
+            ])
+        except Exception as e:
+            error = e
+        for future, func, args in jobs:
+            try:
+                future.set_result(func(self.db, *args))
+            except Exception as e:
+                future.set_exception(e)
+        # Only done once the jobs are too, so flush() covers them
+        if error:
+            batch.set_exception(error)
+        else:
+            batch.set_result(len(deltas))
+
+    def close(self) -> None:
+        """
+            Commit what is left and stop the writer thread.
+        """
+        with self.lock:
+            self.closed = True
+            self.pending.set()
+            self.now.set()
+        self.join()
+